@@ -2,6 +2,7 @@ from dataclasses import dataclass
 import random
 from infection import Infection
 from util import gaussianRandom
+from waning import waningIndex
 from enum import Enum
 
 
@@ -47,9 +48,6 @@ class Actor:
         # Number of days of isolation remaining.
         self.isolatedRemain = 0
 
-        # Number of days to delay before beginning isolation
-        self.isolateAfterRemain = 0
-
         # The number of days this actor was infected.
         self.infectedTime = None
 
@@ -141,7 +139,6 @@ class Actor:
             A return value of 0.5 means half as likely to get infected
         '''
         
-        # TODO: implement waning efficacy over time
         if self.isVaccinated == False:
             # Unvaccinated, so no protection
             return 1.0
@@ -152,9 +149,9 @@ class Actor:
         else:
             # Fully vaccinated, so return the protection to the exposure variant
             full = self.simulationParameters.variantParameters[variant].vaccinationEfficacy
-            current = full
-            # TODO:  Model waning behavior.  Need a reasonable curve.  Sample code below is exponential decay.
-            # current = full * 0.999 ** (self.simulation.simClock - self.vaccinationClock - self.vaccinationDelay)
+            # Waning, looked up by whole days since full protection
+            current = full * self.simulation.vaccinationWaning[
+                waningIndex(self.simulation.simClock - self.vaccinationClock - self.vaccinationDelay)]
             return 1.0 - current
 
         
@@ -164,18 +161,17 @@ class Actor:
             A return value of 0.5 means half as likely to get infected
         '''
         
-        # TODO: implement waning efficacy over time
         if len(self.infections) == 0:
             # Never infected, so no protection
             #print('*')
             return 1.0
         else:
             # Previously infected, so return the max of the reinfection protections of previous variants against the new variant
+            # Waning, looked up by whole days since infection i
             efficacies = []
             for i in self.infections:
-                efficacies.append(self.simulationParameters.variantParameters[i.variant_name].recoveredResistance[variant])
-            # TODO:  Model waning behavior.  Need a reasonable curve.
-            # Can use (self.simulation.simClock - i.time), which is the number of days since infection i
+                efficacies.append(self.simulationParameters.variantParameters[i.variant_name].recoveredResistance[variant]
+                                  * self.simulation.recoveredWaning[i.variant_name][waningIndex(self.simulation.simClock - i.time)])
             return 1.0 - max(efficacies)
 
     # Perform rapid test on actor
@@ -218,12 +214,8 @@ class Actor:
     #  Isolate actor for a number of days.
     #  @param:number days - The number of days to isolate (int).
 
-    def isolateFor(self, days, after=0):
-        if (after == 0):
-            self.isolated = True
-        else:
-            self.isolateAfterRemain = after
-
+    def isolateFor(self, days):
+        self.isolated = True
         self.isolatedRemain = days
 
     #
@@ -245,11 +237,6 @@ class Actor:
 
             self.isSymptomatic = self.myInfection.isSymptomatic()
 
-        if (self.isolateAfterRemain > 0):
-            self.isolateAfterRemain -= days
-            if (self.isolateAfterRemain <= 0):
-                self.isolated = True
-
         # Advance the clock
         if self.infectedTime is not None:
             self.infectedTime += days
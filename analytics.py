@@ -0,0 +1,178 @@
+import numpy as np
+
+# Outbreak analytics over infection records (from_id, to_id, variant, time). The
+# records are indexed once: every infection (event) gets its source, the event that
+# infected its infector, so generation intervals and offspring counts are array
+# lookups, and the source -> infection adjacency is kept in CSR form. Records can be
+# appended while a run is in progress; each batch is indexed as it arrives.
+
+
+class InfectionIndex:
+    '''Infection records indexed by infector.
+
+    Events are numbered in the order they are appended. Batches must be appended in
+    time order (a batch may span several ticks, but none earlier than the last
+    batch). from_id -1 marks infections without a known infector (initial and
+    external ones). variants names the variant indices, if known.
+    '''
+
+    def __init__(self, variants=None, capacity=1024):
+        self.variants = variants
+        self.size = 0
+        self.fromId = np.zeros(capacity, dtype=np.int64)
+        self.toId = np.zeros(capacity, dtype=np.int64)
+        self.variant = np.zeros(capacity, dtype=np.int16)
+        self.time = np.zeros(capacity, dtype=np.float64)
+        # event that infected the infector, -1 if unknown
+        self.source = np.zeros(capacity, dtype=np.int64)
+        # number of infections caused by the event
+        self.offspring = np.zeros(capacity, dtype=np.int64)
+        # most recent event of every actor, -1 if never infected
+        self.latest = np.zeros(0, dtype=np.int64)
+        self._csr = None
+
+    @classmethod
+    def fromRecords(cls, records, variants=None):
+        '''Index of (from_id, to_id, variant index, time) arrays, as ArraySimulation.infectionRecords()'''
+        index = cls(variants, capacity=max(1024, len(records[1])))
+        index.append(*records)
+        return index
+
+    @classmethod
+    def fromDataFrame(cls, df):
+        '''Index of a Simulation.infectionsDF() dataframe'''
+        variants, codes = np.unique(df['variant_name'].to_numpy().astype(str), return_inverse=True)
+        return cls.fromRecords((df['from_id'].to_numpy(), df['to_id'].to_numpy(), codes, df['time'].to_numpy()),
+                               [str(variant) for variant in variants])
+
+    @classmethod
+    def fromEvents(cls, events):
+        '''Index of the transmissions of a locsim EventLog (or its EVENT_DTYPE records)'''
+        if hasattr(events, 'transmissions'):
+            events = events.transmissions()
+        return cls.fromRecords((events['infector'], events['infectee'], np.zeros(len(events), np.int16),
+                                events['time']))
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self, size, actors):
+        if size > len(self.toId):
+            capacity = max(size, 2 * len(self.toId))
+            for name in ('fromId', 'toId', 'variant', 'time', 'source', 'offspring'):
+                column = getattr(self, name)
+                grown = np.zeros(capacity, dtype=column.dtype)
+                grown[:self.size] = column[:self.size]
+                setattr(self, name, grown)
+        if actors > len(self.latest):
+            grown = np.full(max(actors, 2 * len(self.latest)), -1, dtype=np.int64)
+            grown[:len(self.latest)] = self.latest
+            self.latest = grown
+
+    def append(self, fromIds, toIds, variants, times):
+        '''Index a batch of records'''
+        toIds = np.asarray(toIds, dtype=np.int64)
+        n = len(toIds)
+        if n == 0:
+            return
+        fromIds = np.broadcast_to(np.asarray(fromIds, dtype=np.int64), n)
+        variants = np.broadcast_to(np.asarray(variants), n)
+        times = np.broadcast_to(np.asarray(times, dtype=np.float64), n)
+        order = np.argsort(times, kind='stable')
+        fromIds, toIds, variants, times = fromIds[order], toIds[order], variants[order], times[order]
+        first = self.size
+        events = np.arange(first, first + n)
+        self._grow(first + n, max(toIds.max(), fromIds.max()) + 1)
+
+        # the infector's latest infection before the record: within the batch (ranked
+        # by (actor, time)), else the latest from earlier batches
+        rank = np.unique(times, return_inverse=True)[1].ravel()
+        key = toIds * (n + 1) + rank
+        byKey = np.argsort(key, kind='stable')
+        known = fromIds >= 0
+        pos = np.searchsorted(key[byKey], fromIds * (n + 1) + rank, side='left') - 1
+        within = known & (pos >= 0)
+        within[within] = toIds[byKey[pos[within]]] == fromIds[within]
+        source = np.full(n, -1, dtype=np.int64)
+        source[within] = events[byKey[pos[within]]]
+        earlier = known & ~within
+        source[earlier] = self.latest[fromIds[earlier]]
+
+        end = first + n
+        self.fromId[first:end], self.toId[first:end] = fromIds, toIds
+        self.variant[first:end], self.time[first:end] = variants, times
+        self.source[first:end] = source
+        self.offspring[first:end] = 0
+        np.add.at(self.offspring, source[source >= 0], 1)
+        # sorted by time, so the last write per actor is its latest event
+        self.latest[toIds] = events
+        self.size = end
+        self._csr = None
+
+    def children(self, event):
+        '''Events caused by event, in time order (CSR source -> infection index)'''
+        if self._csr is None:
+            source = self.source[:self.size]
+            order = np.argsort(source, kind='stable')
+            order = order[source[order] >= 0]
+            ptr = np.zeros(self.size + 1, dtype=np.int64)
+            np.cumsum(self.offspring[:self.size], out=ptr[1:])
+            self._csr = (ptr, order)
+        ptr, order = self._csr
+        return order[ptr[event]:ptr[event + 1]]
+
+    def _window(self, start, end):
+        time = self.time[:self.size]
+        return (time >= start) & (time < end)
+
+    def generationIntervals(self, start=0.0, end=np.inf):
+        '''Times from the infector's infection to the infection, for infections in [start, end)'''
+        source = self.source[:self.size]
+        mask = self._window(start, end) & (source >= 0)
+        return self.time[:self.size][mask] - self.time[source[mask]]
+
+    def offspringDistribution(self, start=0.0, end=np.inf):
+        '''Number of events infected in [start, end) with 0, 1, 2, ... offspring'''
+        return np.bincount(self.offspring[:self.size][self._window(start, end)])
+
+    def attackRates(self, populationSize, start=0.0, end=np.inf):
+        '''Fraction of the population infected with each variant in [start, end)'''
+        mask = self._window(start, end)
+        variantCount = int(self.variant[:self.size].max()) + 1 if self.size else 0
+        if self.variants is not None:
+            variantCount = max(variantCount, len(self.variants))
+        infected = np.unique(self.toId[:self.size][mask] * max(variantCount, 1) + self.variant[:self.size][mask])
+        return np.bincount(infected % max(variantCount, 1), minlength=variantCount) / populationSize
+
+    def _daily(self, values, mask, window, days):
+        # rolling sums over the window days ending on each day 0..days-1
+        day = np.floor(self.time[:self.size][mask]).astype(np.int64)
+        keep = (day >= 0) & (day < days)
+        sums = np.concatenate(([0.0], np.cumsum(np.bincount(day[keep], values[keep], minlength=days))))
+        counts = np.concatenate(([0], np.cumsum(np.bincount(day[keep], minlength=days))))
+        low = np.maximum(np.arange(days) + 1 - window, 0)
+        high = np.arange(days) + 1
+        total, count = sums[high] - sums[low], counts[high] - counts[low]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, total / count, np.nan)
+
+    def _days(self, days):
+        if days is None:
+            days = int(np.floor(self.time[:self.size].max())) + 1 if self.size else 0
+        return days
+
+    def rt(self, window=7, days=None):
+        '''Case reproduction number by day of infection: mean offspring of the events
+        infected in the window days ending on each day 0..days-1. Recent days are
+        underestimated until their infections have finished infecting others.
+        '''
+        days = self._days(days)
+        mask = np.ones(self.size, dtype=bool)
+        return self._daily(self.offspring[:self.size].astype(np.float64), mask, window, days)
+
+    def meanGenerationInterval(self, window=7, days=None):
+        '''Mean generation interval of the infections in the window days ending on each day'''
+        days = self._days(days)
+        source = self.source[:self.size]
+        mask = source >= 0
+        return self._daily(self.time[:self.size][mask] - self.time[source[mask]], mask, window, days)
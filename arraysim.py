@@ -0,0 +1,683 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from actor import ACTOR_STATUS
+from simulation import RunStatistics
+from tracing import ContactTracer
+from waning import WANING_DAYS, waningTable
+from pcrlab import PcrLab
+
+# Array engine: the same model as simulation.Simulation, with the population held
+# as one array per Actor attribute instead of one Actor object per person.
+# The per-actor phases are functions over a slice of the population (a shard), so
+# the same kernels run single threaded, on threads or in worker processes.
+
+SUSCEPTIBLE = ACTOR_STATUS.SUSCEPTIBLE.value
+EXPOSED = ACTOR_STATUS.EXPOSED.value
+INFECTIOUS = ACTOR_STATUS.INFECTIOUS.value
+RECOVERED = ACTOR_STATUS.RECOVERED.value
+DECEASED = ACTOR_STATUS.DECEASED.value
+
+# Columns of a totals row, named as the RunStatistics attributes. The PCR lab columns
+# are filled in by the engine, not by the shards (see tickTotals)
+TOTALS = ('susceptible', 'infected', 'recovered', 'deceased', 'testsConducted', 'daysLost',
+          'pcrQueue', 'pcrTurnaround')
+
+# SimulationParameters attributes copied as is into CompiledParameters
+SCALAR_PARAMETERS = (
+    'populationSize', 'startingInfectionRate', 'numInteractions', 'numInteractionsSTD',
+    'positiveQuarantineRate', 'positiveTestIsolationInterval',
+    'startingVaccinationRate', 'vaccinationMean', 'vaccinationSTD', 'vaccinationRate', 'vaccinationDelay',
+    'nonCompliantRate',
+    'testingInterval', 'testingRate', 'testingRateRandom', 'falsePositiveRate', 'falseNegative',
+    'testingRatePcr', 'testingRateRandomPcr', 'testingIntervalPcr', 'falsePositiveRatePcr', 'falseNegativePcr',
+    'daysToPcrResults', 'pcrLabCapacity',
+    'contactTracingCoverage', 'contactTracingDelay', 'contactTracingDays', 'contactTracingAction',
+    'contactTracingQuarantine',
+)
+
+# VariantParameters attributes compiled into one array indexed by variant
+VARIANT_PARAMETERS = (
+    'transmissionRate', 'asymptomaticRate', 'selfIsolationRate',
+    'daysToContagious', 'daysToContagiousSTD', 'daysToRecovery', 'daysToRecoverySTD',
+    'daysToSymptoms', 'daysToSymptomsSTD', 'daysToPcrDetectable', 'daysToPcrDetectableSTD',
+    'durationDaysOfPcrDetection', 'durationDaysOfPcrDetectionSTD',
+    'daysToAntigenDetectable', 'daysToAntigenDetectableSTD',
+    'durationDaysOfAntigenDetection', 'durationDaysOfAntigenDetectionSTD',
+    'vaccinationEfficacy',
+)
+
+
+class CompiledParameters:
+    '''Numeric (picklable) form of SimulationParameters used by the array engines.
+
+    Variants are numbered in the order of simulationParameters.variantParameters.
+    '''
+
+    def __init__(self, simulationParameters):
+        p = simulationParameters
+        for name in SCALAR_PARAMETERS:
+            setattr(self, name, getattr(p, name))
+
+        self.variants = list(p.variantParameters)
+        variants = [p.variantParameters[v] for v in self.variants]
+        for name in VARIANT_PARAMETERS:
+            setattr(self, name, np.array([getattr(v, name) for v in variants], dtype=np.float64))
+        self.startingVariantMix = np.array([p.startingVariantMix.get(v, 0.0) for v in self.variants])
+        # recoveredResistance[past variant, new variant]
+        self.recoveredResistance = np.array([[v.recoveredResistance.get(w, 0.0) for w in self.variants]
+                                             for v in variants])
+        # infectionFatalityRateByAge[variant, age bracket]
+        self.infectionFatalityRateByAge = np.array([v.infectionFatalityRateByAge for v in variants])
+        # Waning tables: vaccinationWaning[day], recoveredWaning[past variant, day]
+        self.vaccinationWaning = np.array(waningTable(p.vaccinationWaning))
+        self.recoveredWaning = np.array([waningTable(v.recoveredWaning) for v in variants])
+        self.startingRecoveredList = [(self.variants.index(v), rate, mean, std)
+                                      for v, rate, mean, std in p.startingRecoveredList]
+        # Simulation samples the age bracket index weighted by the ageBrackets list
+        self.ageWeights = np.array(p.ageBrackets, dtype=np.float64)
+        # Cap on sampled interactions per day, so encounter buffers can be preallocated
+        self.maxInteractions = int(math.ceil(p.numInteractions + 6 * p.numInteractionsSTD))
+
+
+# name, dtype, initial value, whether the field has one column per variant
+STATE_FIELDS = (
+    ('status', np.int8, SUSCEPTIBLE, False),
+    ('isolated', np.bool_, False, False),
+    ('isolatedRemain', np.float64, 0.0, False),
+    ('daysIsolated', np.float64, 0.0, False),
+    ('testTime', np.float64, np.nan, False),       # nan: never tested
+    ('testTimePcr', np.float64, np.nan, False),
+    ('testsConducted', np.int32, 0, False),
+    ('testsConductedPcr', np.int32, 0, False),
+    ('isSymptomatic', np.bool_, False, False),
+    ('isVaccinated', np.bool_, False, False),
+    ('vaccinationDelay', np.float64, 0.0, False),
+    ('vaccinationClock', np.float64, -np.inf, False),
+    ('willSelfIsolate', np.bool_, True, False),
+    ('isNonCompliant', np.bool_, False, False),
+    ('isTesting', np.bool_, False, False),
+    ('isTestingPcr', np.bool_, False, False),
+    ('ageBracket', np.int8, 0, False),
+    # current infection (Infection), infectedTime is nan when never infected
+    ('variant', np.int8, -1, False),
+    ('infectedTime', np.float64, np.nan, False),
+    ('asymptomatic', np.bool_, False, False),
+    ('isFatal', np.bool_, False, False),
+    ('daysToContagious', np.float64, 0.0, False),
+    ('daysToNotContagious', np.float64, 0.0, False),
+    ('daysToSymptomatic', np.float64, 0.0, False),
+    ('daysToNotSymptomatic', np.float64, 0.0, False),
+    ('daysToPcrDetectable', np.float64, 0.0, False),
+    ('daysToPcrNotDetectable', np.float64, 0.0, False),
+    ('daysToAntigenDetectable', np.float64, 0.0, False),
+    ('daysToAntigenNotDetectable', np.float64, 0.0, False),
+    # simClock of the most recent infection with each variant, nan if never
+    ('variantClock', np.float64, np.nan, True),
+    # number of infections so far, numbers the infection timelines of paired runs
+    ('infections', np.int32, 0, False),
+)
+
+
+def stateLayout(populationSize, variantCount):
+    '''(name, shape, dtype) of every population state array'''
+    return [(name, (populationSize, variantCount) if perVariant else (populationSize,), np.dtype(dtype))
+            for name, dtype, fill, perVariant in STATE_FIELDS]
+
+
+class PopulationState:
+    '''The population as one array per actor attribute.
+
+    arrays, if given, maps field names to preallocated arrays (e.g. in shared
+    memory) that are reset to the initial values.
+    '''
+
+    def __init__(self, populationSize, variantCount, arrays=None):
+        self.populationSize = populationSize
+        for (name, shape, dtype), (_, _, fill, _) in zip(stateLayout(populationSize, variantCount), STATE_FIELDS):
+            if arrays is None:
+                setattr(self, name, np.full(shape, fill, dtype))
+            else:
+                arrays[name][...] = fill
+                setattr(self, name, arrays[name])
+
+    @classmethod
+    def fromArrays(cls, populationSize, arrays):
+        '''State over existing arrays, as they are'''
+        state = cls.__new__(cls)
+        state.populationSize = populationSize
+        for name, dtype, fill, perVariant in STATE_FIELDS:
+            setattr(state, name, arrays[name])
+        return state
+
+    def arrays(self):
+        return {name: getattr(self, name) for name, dtype, fill, perVariant in STATE_FIELDS}
+
+
+class InfectionLog:
+    '''Append-only InfectionRecord columns (from_id, to_id, variant, time)'''
+
+    def __init__(self):
+        self.parts = []
+
+    def append(self, fromIds, toIds, variants, time):
+        shape = np.shape(toIds)
+        self.parts.append((np.broadcast_to(np.asarray(fromIds, dtype=np.int64), shape),
+                           np.asarray(toIds, dtype=np.int64),
+                           np.broadcast_to(np.asarray(variants, dtype=np.int8), shape),
+                           np.broadcast_to(np.asarray(time, dtype=np.float64), shape)))
+
+    def arrays(self):
+        if not self.parts:
+            return (np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int8), np.zeros(0))
+        return tuple(np.concatenate(column) for column in zip(*self.parts))
+
+
+# Random draws. The kernels take rng, either a numpy Generator, drawn from in sequence,
+# or a PairedRandom for common random numbers. Through draws() every use of rng is
+# named after what it decides; a PairedRandom derives each draw from that name, the
+# actor and a counter (the clock, or the actor's infection number) alone, so two runs
+# with the same seed make the same draw for the same decision whatever else differs.
+
+def _mix(x):
+    # splitmix64 finalizer
+    x = (x ^ (x >> 30)) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> 27)) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> 31)
+
+
+def _counter(value):
+    value = np.asarray(value)
+    if value.dtype.kind == 'f':
+        return value.astype(np.float64).view(np.uint64)
+    return value.astype(np.uint64)
+
+
+class PairedRandom:
+    '''Counter based random streams for paired (common random numbers) runs.
+
+    Draws are hashes of the seed, the stream name, the actor id, a counter and a
+    draw number instead of positions in one sequence, so they do not shift when a
+    policy change alters how many draws other decisions take. generator() gives an
+    ordinary Generator per stream for draws not tied to an actor (the population build).
+    '''
+
+    def __init__(self, seed=None):
+        self.seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.keys = {}
+
+    def _stream(self, name):
+        return np.random.SeedSequence(self.seed.entropy, spawn_key=self.seed.spawn_key + tuple(name.encode()))
+
+    def key(self, name):
+        if name not in self.keys:
+            self.keys[name] = self._stream(name).generate_state(1, np.uint64)[0]
+        return self.keys[name]
+
+    def generator(self, name):
+        return np.random.default_rng(self._stream(name))
+
+    def draws(self, name, ids, counter, index=None):
+        return ActorDraws(self.key(name), ids, counter, index)
+
+
+class ActorDraws:
+    '''Generator-like draws of one PairedRandom stream, one value per actor in ids
+    (per element of index if given) for every call; size arguments are ignored.
+    '''
+
+    def __init__(self, key, ids, counter, index=None):
+        h = _mix(np.asarray(ids, dtype=np.int64).astype(np.uint64) ^ key)
+        h = h + _counter(counter) * np.uint64(0x9E3779B97F4A7C15)
+        if index is not None:
+            h = _mix(h) + (_counter(index) + np.uint64(1)) * np.uint64(0xD6E8FEB86659FD93)
+        self.base = _mix(h)
+        self.calls = 0
+
+    def random(self, size=None):
+        self.calls += 1
+        h = _mix(self.base ^ np.uint64(self.calls))
+        return (h >> np.uint64(11)) * (1.0 / (1 << 53))
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        radius = np.sqrt(-2.0 * np.log1p(-self.random()))
+        return loc + scale * radius * np.cos(2.0 * np.pi * self.random())
+
+    def integers(self, low, high, size=None):
+        return low + (self.random() * (high - low)).astype(np.int64)
+
+
+def draws(rng, name, ids, counter, index=None):
+    '''Source of the draws named name about actors ids: rng itself for a Generator'''
+    if isinstance(rng, PairedRandom):
+        return rng.draws(name, ids, counter, index)
+    return rng
+
+
+def generator(rng, name):
+    '''Generator for the draws named name that are not tied to an actor'''
+    if isinstance(rng, PairedRandom):
+        return rng.generator(name)
+    return rng
+
+
+def infect(state, p, ids, variants, infectors, clock, rng, log):
+    '''Actor.infect for every actor in ids, sampling a new Infection timeline'''
+    k = len(ids)
+    if k == 0:
+        return
+    rng = draws(rng, 'timelines', ids, state.infections[ids])
+    normal = rng.normal
+    state.infections[ids] += 1
+    state.status[ids] = EXPOSED
+    state.variant[ids] = variants
+    state.infectedTime[ids] = 0.0
+    state.asymptomatic[ids] = rng.random(k) < p.asymptomaticRate[variants]
+    contagious = normal(p.daysToContagious[variants], p.daysToContagiousSTD[variants])
+    state.daysToContagious[ids] = contagious
+    state.daysToNotContagious[ids] = contagious + normal(
+        p.daysToRecovery[variants] - p.daysToContagious[variants], p.daysToRecoverySTD[variants])
+    symptomatic = normal(p.daysToSymptoms[variants], p.daysToSymptomsSTD[variants])
+    state.daysToSymptomatic[ids] = symptomatic
+    state.daysToNotSymptomatic[ids] = symptomatic + normal(p.daysToRecovery[variants], p.daysToRecoverySTD[variants])
+    pcr = normal(p.daysToPcrDetectable[variants], p.daysToPcrDetectableSTD[variants])
+    state.daysToPcrDetectable[ids] = pcr
+    state.daysToPcrNotDetectable[ids] = pcr + normal(p.durationDaysOfPcrDetection[variants],
+                                                     p.durationDaysOfPcrDetectionSTD[variants])
+    antigen = pcr + normal(p.daysToAntigenDetectable[variants] - p.daysToPcrDetectable[variants],
+                           p.daysToAntigenDetectableSTD[variants])
+    state.daysToAntigenDetectable[ids] = antigen
+    state.daysToAntigenNotDetectable[ids] = antigen + normal(p.durationDaysOfAntigenDetection[variants],
+                                                             p.durationDaysOfAntigenDetectionSTD[variants])
+    state.isFatal[ids] = rng.random(k) < p.infectionFatalityRateByAge[variants, state.ageBracket[ids]]
+    state.willSelfIsolate[ids] = rng.random(k) < p.selfIsolationRate[variants]
+    state.variantClock[ids, variants] = clock
+    log.append(infectors, ids, variants, clock)
+
+
+def vaccinate(state, p, ids, clock, rng):
+    state.isVaccinated[ids] = True
+    state.vaccinationClock[ids] = clock
+    state.vaccinationDelay[ids] = draws(rng, 'vaccinationDelay', ids, clock).normal(p.vaccinationDelay, 1.0, len(ids))
+
+
+def isolateFor(state, mask, days):
+    state.isolated[mask] = True
+    state.isolatedRemain[mask] = days
+
+
+def waningDays(days):
+    '''Index into the waning tables of days since protection was acquired (see waning.waningIndex)'''
+    return np.clip(np.nan_to_num(days), 0, WANING_DAYS).astype(np.int64)
+
+
+def exposureRisk(state, p, ids, variants, clock):
+    '''vaccinationProtection * reinfectionProtection of actors ids against variants'''
+    vaccinated = state.isVaccinated[ids] & (state.vaccinationClock[ids] + state.vaccinationDelay[ids] <= clock)
+    waning = p.vaccinationWaning[waningDays(clock - state.vaccinationClock[ids] - state.vaccinationDelay[ids])]
+    vaccination = np.where(vaccinated, 1.0 - p.vaccinationEfficacy[variants] * waning, 1.0)
+    since = clock - state.variantClock[ids]
+    past = ~np.isnan(since)
+    waning = p.recoveredWaning[np.arange(len(p.variants)), waningDays(since)]
+    resistance = np.where(past, p.recoveredResistance.T[variants] * waning, 0.0).max(axis=1, initial=0.0)
+    return vaccination * (1.0 - resistance)
+
+
+def initializePopulation(state, p, rng, log, clock=0.0):
+    '''Draw the starting population as Simulation.__init__ does. Returns the starting totals row.'''
+    n = p.populationSize
+    population = rng
+    rng = generator(rng, 'population')
+    state.isTesting[:] = rng.random(n) < p.testingRate
+    state.isTestingPcr[:] = rng.random(n) < p.testingRatePcr
+    state.isNonCompliant[:] = rng.random(n) < p.nonCompliantRate
+    state.ageBracket[:] = rng.choice(len(p.ageWeights), n, p=p.ageWeights / p.ageWeights.sum())
+
+    # Initial infected subpopulation
+    exposed = rng.choice(n, int(max(1, p.startingInfectionRate * n)), replace=False)
+    variants = rng.choice(len(p.variants), len(exposed), p=p.startingVariantMix / p.startingVariantMix.sum())
+    infect(state, p, exposed, variants, -1, clock, population, log)    # Initial exposures get dummy ID of -1
+
+    # Initial recovered subpopulation
+    recovered = 0
+    for variant, rate, mean, std in p.startingRecoveredList:
+        ids = rng.choice(n, int(max(1, rate * n)), replace=False)
+        days = np.minimum(-2, -rng.normal(mean, std, len(ids)))
+        state.variantClock[ids, variant] = np.fmax(state.variantClock[ids, variant], days)
+        log.append(-1, ids, variant, days)
+        recovered += len(ids)
+
+    # Initial vaccinated subpopulation
+    ids = rng.choice(n, int(max(1, p.startingVaccinationRate * n)), replace=False)
+    vaccinate(state, p, ids, clock - np.maximum(2, rng.normal(p.vaccinationMean, p.vaccinationSTD, len(ids))),
+              population)
+
+    totals = np.zeros(len(TOTALS))
+    totals[TOTALS.index('infected')] = len(exposed)
+    totals[TOTALS.index('recovered')] = recovered
+    totals[TOTALS.index('susceptible')] = n - len(exposed) - recovered
+    return totals
+
+
+# Per tick phases. sl is the slice of the population (shard) a phase works on.
+
+def tickInteractions(state, p, sl, days, clock, rng, encounters=None):
+    '''Exposures caused by the infectious actors of shard sl.
+
+    Only reads the state, so shards can run it concurrently. Returns
+    (targets, infectors, variants) of the encounters that lead to an infection;
+    every encounter's (infectors, targets) is appended to the encounters list if given.
+    '''
+    infectors = sl.start + np.flatnonzero((state.status[sl] == INFECTIOUS) & ~state.isolated[sl])
+    # Determine if we infect based on # of interactions and % of day passed
+    infectors = infectors[draws(rng, 'infectious', infectors, clock).random(len(infectors)) < days]
+    interactions = draws(rng, 'interactions', infectors, clock).normal(
+        p.numInteractions, p.numInteractionsSTD, len(infectors)).astype(np.int64)
+    counts = np.clip(interactions, 0, p.maxInteractions)
+    infectors = np.repeat(infectors, counts)
+    # encounter number of every encounter of its infector
+    encounter = np.arange(len(infectors)) - np.repeat(np.cumsum(counts) - counts, counts)
+    rng = draws(rng, 'encounters', infectors, clock, encounter)
+    targets = rng.integers(0, state.populationSize, len(infectors))
+    if encounters is not None:
+        encounters.append((infectors, targets))
+
+    status = state.status[targets]
+    variants = state.variant[infectors].astype(np.int64)
+    risk = p.transmissionRate[variants] * exposureRisk(state, p, targets, variants, clock)
+    hit = (((status == SUSCEPTIBLE) | (status == RECOVERED))
+           & (rng.random(len(targets)) < risk))
+    return targets[hit], infectors[hit], variants[hit]
+
+
+def applyExposures(state, p, targets, infectors, variants, clock, rng, log):
+    '''Infect the targets of tickInteractions; an actor exposed several times is infected by the first'''
+    targets, first = np.unique(targets, return_index=True)
+    infect(state, p, targets, variants[first], infectors[first], clock, rng, log)
+
+
+def tickRapidTesting(state, p, sl, days, clock, rng):
+    n = sl.stop - sl.start
+    rng = draws(rng, 'rapidTesting', np.arange(sl.start, sl.stop), clock)
+    testTime = state.testTime[sl]
+    due = ((state.isTesting[sl] & (np.isnan(testTime) | (testTime >= p.testingInterval)))
+           | (rng.random(n) < p.testingRateRandom / days))
+    tested = due & ~state.isolated[sl]
+    state.testsConducted[sl] += tested
+    testTime[tested] = 0
+
+    duration = state.infectedTime[sl]
+    status = state.status[sl]
+    detect = (((status == EXPOSED) | (status == INFECTIOUS))
+              & (duration > state.daysToAntigenDetectable[sl]) & (duration < state.daysToAntigenNotDetectable[sl])
+              & (rng.random(n) > p.falseNegative))
+    positive = tested & (detect | (rng.random(n) < p.falsePositiveRate))
+    isolateFor(state, np.flatnonzero(positive & (rng.random(n) < p.positiveQuarantineRate)) + sl.start,
+               p.positiveTestIsolationInterval)
+    selfIsolate(state, p, sl)
+    return np.flatnonzero(positive) + sl.start
+
+
+def tickPcrTesting(state, p, sl, days, clock, rng):
+    '''PCR testing of the shard. Returns the samples for the lab: (ids, positive,
+    isolate) of the tested actors, isolate meaning a positive actor will isolate.
+    '''
+    n = sl.stop - sl.start
+    rng = draws(rng, 'pcrTesting', np.arange(sl.start, sl.stop), clock)
+    testTime = state.testTimePcr[sl]
+    due = ((rng.random(n) < p.testingRateRandomPcr / days)
+           | (state.isTestingPcr[sl] & (np.isnan(testTime) | (testTime >= p.testingIntervalPcr))))
+    tested = due & ~state.isolated[sl]
+    state.testsConductedPcr[sl] += tested
+    testTime[tested] = 0
+
+    duration = state.infectedTime[sl]
+    status = state.status[sl]
+    detect = (((status == EXPOSED) | (status == INFECTIOUS))
+              & (duration > state.daysToPcrDetectable[sl]) & (duration < state.daysToPcrNotDetectable[sl])
+              & (rng.random(n) > p.falseNegativePcr))
+    positive = tested & (detect | (rng.random(n) < p.falsePositiveRatePcr))
+    isolate = positive & (rng.random(n) < p.positiveQuarantineRate)
+    selfIsolate(state, p, sl)
+    ids = np.flatnonzero(tested)
+    return ids + sl.start, positive[ids], isolate[ids]
+
+
+def tickPcrResults(state, p, lab, until):
+    '''Isolate the actors whose positive PCR results (see pcrlab.PcrLab) are due by
+    until and will isolate. Returns the ids of the positive results.
+    '''
+    batches = lab.due(until)
+    if not batches:
+        return np.zeros(0, dtype=np.int64)
+    ids, positive, isolate = (np.concatenate(column) for column in zip(*batches))
+    isolateFor(state, ids[isolate], p.positiveTestIsolationInterval)
+    return ids[positive]
+
+
+def selfIsolate(state, p, sl):
+    # TODO: Some actors become sick and never become "unsick" so they isolate forever.
+    mask = state.isSymptomatic[sl] & state.willSelfIsolate[sl] & ~state.isolated[sl]
+    isolateFor(state, np.flatnonzero(mask) + sl.start, p.positiveTestIsolationInterval)
+
+
+def tickVaccination(state, p, sl, days, clock, rng):
+    n = sl.stop - sl.start
+    chance = draws(rng, 'vaccination', np.arange(sl.start, sl.stop), clock).random(n)
+    ids = np.flatnonzero(~state.isVaccinated[sl] & (chance < p.vaccinationRate * days)) + sl.start
+    vaccinate(state, p, ids, clock, rng)
+
+
+def tickDisease(state, p, sl, days):
+    '''Actor.tick for every actor of the shard'''
+    status = state.status[sl]
+    duration = state.infectedTime[sl]
+    infected = ~np.isnan(duration) & (status != RECOVERED)
+    contagious = (duration > state.daysToContagious[sl]) & (duration < state.daysToNotContagious[sl])
+    ending = infected & (status == INFECTIOUS) & ~contagious
+    status[infected & (status == EXPOSED) & contagious] = INFECTIOUS
+    status[ending] = np.where(state.isFatal[sl][ending], DECEASED, RECOVERED)
+    symptomatic = (~state.asymptomatic[sl]
+                   & (duration > state.daysToSymptomatic[sl]) & (duration < state.daysToNotSymptomatic[sl]))
+    state.isSymptomatic[sl][infected] = symptomatic[infected]
+
+    # Advance the clocks; nan (never infected / never tested) stays nan
+    duration += days
+    isolated = state.isolated[sl]
+    state.daysIsolated[sl][isolated] += days
+    remain = state.isolatedRemain[sl]
+    remain[isolated] -= days
+    isolated[isolated & (remain <= 0)] = False
+    state.testTime[sl] += days
+    state.testTimePcr[sl] += days
+
+
+def traceContacts(state, p, tracer, positives, clock, rng):
+    '''Schedule the traced contacts of the actors positives (see tracing.ContactTracer)'''
+    if len(positives) == 0:
+        return
+    contacts = tracer.contactsOf(positives, clock)
+    traced = contacts[draws(rng, 'tracing', contacts, clock).random(len(contacts)) < p.contactTracingCoverage]
+    tracer.schedule(traced, clock + p.contactTracingDelay)
+
+
+def tickContactTracing(state, p, tracer, clock, rng):
+    '''Isolate or test the traced contacts reached by clock'''
+    ids = tracer.due(clock)
+    ids = ids[~state.isolated[ids] & (state.status[ids] != DECEASED)]
+    if p.contactTracingAction == 'isolate':
+        isolateFor(state, ids, p.contactTracingQuarantine)
+        return
+    test = draws(rng, 'tracingTests', ids, clock)
+    state.testsConducted[ids] += 1
+    state.testTime[ids] = 0
+    duration = state.infectedTime[ids]
+    status = state.status[ids]
+    detect = (((status == EXPOSED) | (status == INFECTIOUS))
+              & (duration > state.daysToAntigenDetectable[ids]) & (duration < state.daysToAntigenNotDetectable[ids])
+              & (test.random(len(ids)) > p.falseNegative))
+    positive = detect | (test.random(len(ids)) < p.falsePositiveRate)
+    isolateFor(state, ids[positive & (test.random(len(ids)) < p.positiveQuarantineRate)],
+               p.positiveTestIsolationInterval)
+    traceContacts(state, p, tracer, ids[positive], clock, rng)
+
+
+def tickTotals(state, sl):
+    '''Totals row (see TOTALS) of the shard, the PCR lab columns left at 0'''
+    counts = np.bincount(state.status[sl], minlength=DECEASED + 1)
+    return np.array([counts[SUSCEPTIBLE], counts[EXPOSED] + counts[INFECTIOUS], counts[RECOVERED],
+                     counts[DECEASED], state.testsConducted[sl].sum(), state.daysIsolated[sl].sum(), 0, 0],
+                    dtype=np.float64)
+
+
+def tickTesting(state, p, sl, days, clock, rng, log, targets, infectors, variants):
+    '''The shard's tick after tickInteractions, up to the PCR lab: apply the exposures
+    aimed at the shard, then testing. Returns the ids of the positive rapid tests and
+    the PCR samples (see tickPcrTesting).
+    '''
+    mine = (targets >= sl.start) & (targets < sl.stop)
+    applyExposures(state, p, targets[mine], infectors[mine], variants[mine], clock, rng, log)
+    rapid = tickRapidTesting(state, p, sl, days, clock, rng)
+    return rapid, tickPcrTesting(state, p, sl, days, clock, rng)
+
+
+def tickProgress(state, p, sl, days, clock, rng):
+    '''The rest of the shard's tick, after the PCR lab: vaccination and disease
+    progression. Returns the totals row.
+    '''
+    tickVaccination(state, p, sl, days, clock, rng)
+    tickDisease(state, p, sl, days)
+    return tickTotals(state, sl)
+
+
+def shards(populationSize, count):
+    '''Contiguous slices splitting the population into count shards'''
+    bounds = np.linspace(0, populationSize, count + 1).astype(np.int64).tolist()
+    return [slice(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+def runStatistics(totals):
+    stats = RunStatistics()
+    for name, value in zip(TOTALS, totals):
+        setattr(stats, name, float(value) if name in ('daysLost', 'pcrTurnaround') else int(value))
+    return stats
+
+
+def infectionsDF(records, variants):
+    '''Return a pandas dataframe with the infection spread data, as Simulation.infectionsDF'''
+    import pandas as pd
+
+    fromIds, toIds, variant, time = records
+    df = pd.DataFrame({'from_id': fromIds, 'to_id': toIds,
+                       'variant_name': np.array(variants, dtype=object)[variant], 'time': time})
+    df.sort_values(['time', 'from_id'], inplace=True)
+    df.reset_index(drop=True, inplace=True)
+    return df
+
+
+class ArraySimulation:
+    '''Drop-in for simulation.Simulation (tick, totals, simClock, infectionsDF) on array state.
+
+    simulationParameters may also be CompiledParameters. With a template
+    (template.PopulationTemplate) the starting population is copied from it instead
+    of being drawn.
+
+    The per-actor phases run on chunks of the population, each with its own random
+    stream, so results are reproducible for a given seed and number of chunks. With
+    threads > 1 the chunks run on a thread pool (numpy releases the GIL in its kernels).
+    chunks defaults to the number of threads.
+
+    With paired=True draws come from a PairedRandom instead (and do not depend on the
+    chunks): runs of two scenarios with the same seed share every draw the difference
+    between the scenarios does not touch, for paired comparisons.
+    '''
+
+    def __init__(self, simulationParameters, seed=None, threads=None, chunks=None, template=None, paired=False):
+        self.simulationParameters = simulationParameters
+        if template is not None:
+            self.parameters = template.parameters
+        elif isinstance(simulationParameters, CompiledParameters):
+            self.parameters = simulationParameters
+        else:
+            self.parameters = CompiledParameters(simulationParameters)
+        self.simClock = 0
+        self.chunks = shards(self.parameters.populationSize, chunks or threads or 1)
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        if paired:
+            self.rng = PairedRandom(seed)
+            self.rngs = [self.rng] * len(self.chunks)
+        else:
+            streams = seed.spawn(len(self.chunks) + 1)
+            self.rng = np.random.default_rng(streams[-1])
+            self.rngs = [np.random.default_rng(stream) for stream in streams[:-1]]
+        self.logs = [InfectionLog() for chunk in self.chunks]
+        self.tracer = ContactTracer.fromParameters(self.parameters)
+        self.pcrLab = PcrLab(self.parameters.pcrLabCapacity, self.parameters.daysToPcrResults)
+        self.executor = ThreadPoolExecutor(threads) if threads and threads > 1 else None
+        if template is None:
+            self.log = InfectionLog()
+            self.state = PopulationState(self.parameters.populationSize, len(self.parameters.variants))
+            self.totals = runStatistics(initializePopulation(self.state, self.parameters, self.rng, self.log))
+        else:
+            # the starting population comes from the template; seed only drives the run
+            self.state, totals, self.log = template.instantiate()
+            self.totals = runStatistics(totals)
+
+    def _map(self, function):
+        chunks = range(len(self.chunks))
+        if self.executor is None:
+            return list(map(function, chunks))
+        return list(self.executor.map(function, chunks))
+
+    def tick(self, days=1):
+        self.simClock += days
+        state, p, clock = self.state, self.parameters, self.simClock
+
+        tracer, lab = self.tracer, self.pcrLab
+        encounters = [[] for chunk in self.chunks] if tracer else [None] * len(self.chunks)
+
+        exposures = self._map(lambda i: tickInteractions(state, p, self.chunks[i], days, clock, self.rngs[i],
+                                                         encounters[i]))
+        targets, infectors, variants = (np.concatenate(column) for column in zip(*exposures))
+        pcrPositives = tickPcrResults(state, p, lab, clock + days)
+        tested = self._map(lambda i: tickTesting(state, p, self.chunks[i], days, clock, self.rngs[i], self.logs[i],
+                                                 targets, infectors, variants))
+        if tracer:
+            for a, b in (pair for chunk in encounters for pair in chunk):
+                tracer.record(a, b, clock)
+        for rapid, samples in tested:
+            lab.submit(clock, *samples)
+            if tracer:
+                traceContacts(state, p, tracer, rapid, clock, self.rng)
+        lab.process(clock, days)
+        # results of this tick's samples that are due within the tick (daysToPcrResults < days)
+        pcrPositives = np.concatenate([pcrPositives, tickPcrResults(state, p, lab, clock + days)])
+        totals = self._map(lambda i: tickProgress(state, p, self.chunks[i], days, clock, self.rngs[i]))
+        if tracer:
+            traceContacts(state, p, tracer, pcrPositives, clock, self.rng)
+            # after the totals, as in Simulation.tick; shows in the next tick's totals
+            tickContactTracing(state, p, tracer, clock, self.rng)
+        totals = np.sum(totals, axis=0)
+        totals[TOTALS.index('pcrQueue')] = lab.queued
+        totals[TOTALS.index('pcrTurnaround')] = lab.turnaround
+        self.totals = runStatistics(totals)
+
+    def infectionRecords(self):
+        '''(from_id, to_id, variant index, time) arrays of every infection so far'''
+        parts = [log.arrays() for log in [self.log] + self.logs]
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    def infectionsDF(self):
+        return infectionsDF(self.infectionRecords(), self.parameters.variants)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,209 @@
+import numpy as np
+from arraysim import TOTALS
+from resultcache import normalizeParameters
+
+# Emulator (surrogate model) of ensemble outcomes for interactive queries. A Gaussian
+# process, trained on stored ensemble results, maps a few input parameters (named as
+# in ensemble.withOverrides, e.g. 'testingRate' or 'omicron.transmissionRate') to
+# the expected per-tick totals, with the uncertainty of that prediction. Points where
+# the emulator is unreliable are reported so they can be given real runs.
+
+# Lengthscales (in units of the training range of an input) tried when fitting
+LENGTHSCALES = np.geomspace(0.05, 5.0, 16)
+
+
+def parameterValue(normalized, name):
+    '''Value of parameter name in resultcache.normalizeParameters output'''
+    if '.' in name:
+        variant, name = name.split('.', 1)
+        return normalized['variantParameters'][variant][name]
+    return normalized[name]
+
+
+def _otherParameters(normalized, inputs):
+    normalized = dict(normalized, variantParameters={variant: dict(values) for variant, values
+                                                     in normalized['variantParameters'].items()})
+    for name in inputs:
+        if '.' in name:
+            variant, name = name.split('.', 1)
+            normalized['variantParameters'][variant].pop(name, None)
+        else:
+            normalized.pop(name, None)
+    return normalized
+
+
+class Emulator:
+    '''Gaussian process regression from input parameter values to per-tick totals.
+
+    x holds the input values of every replicate, shape (replicates, len(inputs)), and
+    totals their totals, shape (replicates, days, len(TOTALS)). Replicates of the same
+    point are averaged; their spread is the noise of that average, per output (day and
+    column). The outputs of each TOTALS column share their fitted lengthscales, so a
+    nearly deterministic column is not smoothed like a noisy one.
+    '''
+
+    def __init__(self, inputs, x, totals):
+        self.inputs = list(inputs)
+        x = np.asarray(x, dtype=np.float64).reshape(len(totals), len(self.inputs))
+        totals = np.asarray(totals, dtype=np.float64)
+        self.shape = totals.shape[1:]
+
+        self.points, group, counts = np.unique(x, axis=0, return_inverse=True, return_counts=True)
+        group = group.ravel()
+        y = totals.reshape(len(totals), -1)
+        mean = np.zeros((len(self.points), y.shape[1]))
+        np.add.at(mean, group, y)
+        mean /= counts[:, None]
+        square = np.zeros_like(mean)
+        np.add.at(square, group, (y - mean[group]) ** 2)
+        repeated = counts > 1
+        variance = np.empty_like(mean)
+        variance[repeated] = square[repeated] / (counts[repeated, None] - 1)
+        # points run once get the average spread of the others
+        variance[~repeated] = variance[repeated].mean(axis=0) if repeated.any() else 0.0
+
+        # standardized inputs (training range -> [0, 1]) and outputs
+        self.low = self.points.min(axis=0)
+        self.range = np.where(self.points.max(axis=0) > self.low, self.points.max(axis=0) - self.low, 1.0)
+        self.outputMean = mean.mean(axis=0)
+        self.outputScale = mean.std(axis=0)
+        varying = self.outputScale > 0
+        self.outputScale[~varying] = 1.0
+        self.y = (mean - self.outputMean) / self.outputScale
+        self.noise = variance / counts[:, None] / self.outputScale ** 2 + 1e-6
+
+        # TOTALS column of every output; lengthscales[column] are shared by its outputs
+        self.groups = np.arange(y.shape[1]) % self.shape[-1]
+        # spread of every TOTALS column over all days and points, against which
+        # reliability is judged (a day's own spread may be nothing but noise)
+        spread = np.array([mean[:, self.groups == g].std() for g in range(self.shape[-1])])
+        self.columnScale = np.where(spread > 0, spread, np.inf)[self.groups]
+        self.lengthscales = np.array([self._fit(np.flatnonzero(self.groups == g)) for g in range(self.shape[-1])])
+        self._factor()
+
+    def _scaled(self, x):
+        return (np.asarray(x, dtype=np.float64) - self.low) / self.range
+
+    def _kernel(self, a, b, lengthscales):
+        d = (a[:, None, :] - b[None, :, :]) / lengthscales
+        return np.exp(-0.5 * np.sum(d * d, axis=-1))
+
+    def _covariances(self, lengthscales, columns):
+        # kernel plus the noise of each output, shape (len(columns), points, points)
+        x = self._scaled(self.points)
+        k = self._kernel(x, x, lengthscales)
+        return k + self.noise[:, columns].T[:, :, None] * np.eye(len(x))
+
+    def _likelihood(self, lengthscales, columns):
+        '''Log marginal likelihood summed over the (standardized) outputs columns'''
+        try:
+            l = np.linalg.cholesky(self._covariances(lengthscales, columns))
+        except np.linalg.LinAlgError:
+            return -np.inf
+        z = np.linalg.solve(l, self.y[:, columns].T[:, :, None])
+        return -0.5 * np.sum(z * z) - np.sum(np.log(np.diagonal(l, axis1=1, axis2=2)))
+
+    def _fit(self, columns):
+        # coordinate search over LENGTHSCALES, one input at a time
+        lengthscales = np.full(len(self.inputs), 0.5)
+        best = self._likelihood(lengthscales, columns)
+        for sweep in range(2):
+            for i in range(len(self.inputs)):
+                for value in LENGTHSCALES:
+                    trial = lengthscales.copy()
+                    trial[i] = value
+                    likelihood = self._likelihood(trial, columns)
+                    if likelihood > best:
+                        best, lengthscales = likelihood, trial
+        return lengthscales
+
+    def _factor(self):
+        # per output: cholesky[output] of its covariance, and alpha[:, output]
+        n, outputs = self.y.shape
+        self.cholesky = np.empty((outputs, n, n))
+        self.alpha = np.empty((n, outputs))
+        for g, lengthscales in enumerate(self.lengthscales):
+            columns = np.flatnonzero(self.groups == g)
+            l = np.linalg.cholesky(self._covariances(lengthscales, columns))
+            z = np.linalg.solve(l, self.y[:, columns].T[:, :, None])
+            self.cholesky[columns] = l
+            self.alpha[:, columns] = np.linalg.solve(np.swapaxes(l, 1, 2), z)[:, :, 0].T
+
+    def _posterior(self, x):
+        # standardized mean and uncertainty (prior 1) of every output at scaled inputs x
+        points = self._scaled(self.points)
+        mean = np.empty((len(x), self.y.shape[1]))
+        uncertainty = np.empty_like(mean)
+        for g, lengthscales in enumerate(self.lengthscales):
+            columns = np.flatnonzero(self.groups == g)
+            k = self._kernel(x, points, lengthscales)
+            mean[:, columns] = k @ self.alpha[:, columns]
+            v = np.linalg.solve(self.cholesky[columns], np.broadcast_to(k.T, (len(columns),) + k.T.shape))
+            uncertainty[:, columns] = np.sqrt(np.maximum(1.0 - np.sum(v * v, axis=1), 0.0)).T
+        return mean, uncertainty
+
+    def _uncertainty(self, uncertainty):
+        # uncertainty of a point: its largest over the outputs, relative to their column
+        return np.max(uncertainty * self.outputScale / self.columnScale, axis=1)
+
+    def _matrix(self, points):
+        if len(points) and isinstance(points[0], dict):
+            return np.array([[point[name] for name in self.inputs] for point in points], dtype=np.float64)
+        return np.asarray(points, dtype=np.float64).reshape(-1, len(self.inputs))
+
+    def predict(self, points, maxUncertainty=0.5):
+        '''Expected totals at points (dicts of input values, or rows of them).
+
+        Returns {'mean', 'std'}, both shape (len(points), days, len(TOTALS)), std being
+        the uncertainty of the expected totals, and 'reliable', False for points
+        outside the training range or where the uncertainty of any output exceeds
+        maxUncertainty (relative to the spread of its column's training results).
+        '''
+        x = self._scaled(self._matrix(points))
+        mean, uncertainty = self._posterior(x)
+        inside = np.all((x >= -1e-9) & (x <= 1 + 1e-9), axis=1)
+        return {'mean': (mean * self.outputScale + self.outputMean).reshape((len(x),) + self.shape),
+                'std': (uncertainty * self.outputScale).reshape((len(x),) + self.shape),
+                'reliable': inside & (self._uncertainty(uncertainty) <= maxUncertainty)}
+
+    def uncertain(self, candidates, count):
+        '''The count candidate points where the emulator is least certain, to run next'''
+        mean, uncertainty = self._posterior(self._scaled(self._matrix(candidates)))
+        order = np.argsort(-self._uncertainty(uncertainty), kind='stable')[:count]
+        return [candidates[i] for i in order]
+
+    @classmethod
+    def fromSweep(cls, inputs, points, totals):
+        '''Emulator of ensemble.runSweep output: points (override dicts) and totals,
+        shape (len(points), replicates, days, len(TOTALS))'''
+        totals = np.asarray(totals)
+        x = np.repeat([[point[name] for name in inputs] for point in points], totals.shape[1], axis=0)
+        return cls(inputs, x, totals.reshape((-1,) + totals.shape[2:]))
+
+    @classmethod
+    def fromCache(cls, cache, inputs, base=None, days=None):
+        '''Emulator of the ensemble results in a resultcache.ResultCache.
+
+        With base (a SimulationParameters, or normalizeParameters output) only results
+        whose parameters other than inputs equal base's are used. days defaults to the
+        most common horizon among the results.
+        '''
+        if base is not None:
+            base = _otherParameters(base if isinstance(base, dict) else normalizeParameters(base), inputs)
+
+        samples = []
+        for key, entry in cache.entries():
+            parameters = entry['metadata'].get('parameters')
+            if parameters is None or (base is not None and _otherParameters(parameters, inputs) != base):
+                continue
+            # results stored before a change of the TOTALS columns
+            if np.shape(entry['totals'])[1:] != (len(TOTALS),):
+                continue
+            samples.append(([parameterValue(parameters, name) for name in inputs], entry['totals']))
+        if days is None and samples:
+            horizons, counts = np.unique([len(totals) for x, totals in samples], return_counts=True)
+            days = horizons[np.argmax(counts)]
+        samples = [(x, totals) for x, totals in samples if len(totals) == days]
+        if not samples:
+            raise ValueError('no cached results to train on')
+        return cls(inputs, [x for x, totals in samples], [totals for x, totals in samples])
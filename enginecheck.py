@@ -0,0 +1,103 @@
+'''Engine equivalence check.
+
+Runs the same scenario on the three engines and fails (exit status 1) if
+
+  - SharedSimulation(workers=N) and ArraySimulation(chunks=N) with the same seed
+    differ in any per-tick total or infection record (they must be identical), or
+  - the per-tick totals of ArraySimulation and Simulation, averaged over --seeds
+    runs each, differ by more than --sigmas standard errors (they must agree
+    within noise).
+
+The scenario has PCR testing. The identity check runs it with unlimited lab
+capacity: with limited capacity SharedSimulation runs a lab per shard, whose
+queues are not in the order of the single lab of the other engines.
+
+    python enginecheck.py [--population 5000] [--days 60] [--workers 3] [--seeds 16]
+'''
+import argparse
+import random
+import sys
+
+import numpy as np
+
+from arraysim import TOTALS, ArraySimulation
+from sharedsim import SharedSimulation
+from simulation import Simulation, SimulationParameters
+
+
+def totalsRow(sim):
+    return [getattr(sim.totals, name) for name in TOTALS]
+
+
+def runTotals(sim, days):
+    '''Per-tick totals of days ticks of sim, shape (days, len(TOTALS))'''
+    rows = []
+    for day in range(days):
+        sim.tick()
+        rows.append(totalsRow(sim))
+    return np.array(rows, dtype=np.float64)
+
+
+def checkShared(parameters, days, workers, seed):
+    '''Names of what differs between SharedSimulation and ArraySimulation runs'''
+    with SharedSimulation(parameters, workers=workers, seed=seed) as shared:
+        sharedTotals = runTotals(shared, days)
+        sharedRecords = shared.infectionRecords()
+    with ArraySimulation(parameters, seed=seed, chunks=workers) as array:
+        arrayTotals = runTotals(array, days)
+        arrayRecords = array.infectionRecords()
+
+    different = [name for i, name in enumerate(TOTALS) if not np.array_equal(sharedTotals[:, i], arrayTotals[:, i])]
+    if not all(np.array_equal(a, b) for a, b in zip(sharedRecords, arrayRecords)):
+        different.append('infectionRecords')
+    return different
+
+
+def checkSimulation(parameters, days, seeds):
+    '''{TOTALS column: largest difference of the means, in standard errors}'''
+    array, reference = [], []
+    for seed in range(seeds):
+        with ArraySimulation(parameters, seed=seed) as sim:
+            array.append(runTotals(sim, days))
+        random.seed(seed)
+        reference.append(runTotals(Simulation(parameters), days))
+    array, reference = np.array(array), np.array(reference)
+
+    difference = np.abs(array.mean(axis=0) - reference.mean(axis=0))
+    error = np.sqrt((array.var(axis=0, ddof=1) + reference.var(axis=0, ddof=1)) / seeds)
+    # one count of slack, for columns that are (nearly) deterministic
+    z = difference / (error + 1.0)
+    return {name: z[:, i].max() for i, name in enumerate(TOTALS)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--population', type=int, default=5000)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--seeds', type=int, default=16, help='runs of each engine for the within-noise check')
+    parser.add_argument('--sigmas', type=float, default=4.0)
+    args = parser.parse_args()
+
+    parameters = SimulationParameters()
+    parameters.populationSize = args.population
+    parameters.testingRatePcr = 0.3
+
+    failed = False
+    different = checkShared(parameters, args.days, args.workers, seed=1)
+    status = 'DIFFERENT ' + ','.join(different) if different else 'ok'
+    failed |= bool(different)
+    print(f'SharedSimulation(workers={args.workers}) == ArraySimulation(chunks={args.workers})  {status}')
+
+    # a lab that falls behind, so the lab queue is compared too
+    parameters.pcrLabCapacity = args.population // 100
+    for name, z in checkSimulation(parameters, args.days, args.seeds).items():
+        status = 'ok' if z <= args.sigmas else 'DIFFERENT'
+        failed |= status != 'ok'
+        print(f'ArraySimulation ~ Simulation  {name:14} {z:5.2f} sigma  {status}')
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,338 @@
+import copy
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from arraysim import ArraySimulation, TOTALS
+from template import PopulationTemplate, LocsimTemplate
+from resultcache import normalizeParameters, resultKey
+
+# Ensembles of ArraySimulation replicates. The starting population is built once as
+# a PopulationTemplate, published in shared memory and attached to by every worker;
+# each replicate copies only its mutable state.
+# With a resultcache.ResultCache, replicates already computed for the same parameters,
+# seed, horizon and code are read back instead of being run again.
+# locsim ensembles share their population and contact graph the same way (LocsimTemplate).
+
+# Templates attached in this (worker) process, by shared memory name
+_templates = {}
+
+
+def _attach(handle, cls=PopulationTemplate):
+    name = handle[0][0]
+    if name not in _templates:
+        _templates[name] = cls.attach(handle)
+    return _templates[name]
+
+
+def templateSeed(seed):
+    '''Seed of the starting population of an ensemble'''
+    root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    return np.random.SeedSequence(root.entropy, spawn_key=root.spawn_key + (0,))
+
+
+def replicateSeed(seed, index):
+    '''Seed of replicate index of an ensemble; independent of how many replicates are run'''
+    root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    return np.random.SeedSequence(root.entropy, spawn_key=root.spawn_key + (1 + index,))
+
+
+def runReplicate(template, seed, days, records=False, paired=False):
+    '''Run one replicate for days ticks.
+
+    Returns its totals, shape (days, len(TOTALS)), and with records also its
+    infection records.
+    '''
+    simulation = ArraySimulation(template.parameters, seed=seed, template=template, paired=paired)
+    totals = np.zeros((days, len(TOTALS)))
+    for day in range(days):
+        simulation.tick()
+        totals[day] = [getattr(simulation.totals, name) for name in TOTALS]
+    return (totals, simulation.infectionRecords()) if records else totals
+
+
+def _replicate(handle, seed, days, records=False, paired=False):
+    return runReplicate(_attach(handle), seed, days, records, paired)
+
+
+def _key(simulationParameters, seed, days, paired):
+    return resultKey(simulationParameters, seed, days, **({'paired': True} if paired else {}))
+
+
+def _cached(cache, simulationParameters, seed, days, records, paired=False):
+    entry = cache.get(_key(simulationParameters, seed, days, paired))
+    if entry is None or (records and 'records' not in entry):
+        return None
+    return (entry['totals'], entry.get('records')) if records else entry['totals']
+
+
+def _store(cache, simulationParameters, seed, days, records, result, metadata, paired=False):
+    totals, infections = result if records else (result, None)
+    metadata = dict(metadata, parameters=normalizeParameters(simulationParameters), days=days)
+    cache.put(_key(simulationParameters, seed, days, paired), totals, infections, metadata)
+
+
+def runEnsemble(simulationParameters, replicates, days, seed=None, workers=None, cache=None, records=False,
+                first=0, paired=False):
+    '''Run replicates of the same scenario on a process pool (inline if workers == 1).
+
+    Returns the per-tick totals, shape (replicates, days, len(TOTALS)), columns as
+    TOTALS; with records also the list of the replicates' infection records.
+    Replicates first..first+replicates-1 of the scenario are run, so an ensemble can
+    be extended later. cache is only used when seed is given. paired runs the
+    replicates with common random numbers (see runPaired).
+    '''
+    seeds = [replicateSeed(seed, first + r) for r in range(replicates)]
+    results = [None] * replicates
+    caching = cache is not None and seed is not None
+    if caching:
+        results = [_cached(cache, simulationParameters, s, days, records, paired) for s in seeds]
+
+    missing = [r for r in range(replicates) if results[r] is None]
+    if missing:
+        template = PopulationTemplate(simulationParameters, templateSeed(seed), paired)
+        if workers == 1:
+            computed = [runReplicate(template, seeds[r], days, records, paired) for r in missing]
+        else:
+            handle = template.publish()
+            try:
+                with multiprocessing.get_context().Pool(workers) as pool:
+                    computed = pool.starmap(_replicate, [(handle, seeds[r], days, records, paired)
+                                                         for r in missing])
+            finally:
+                template.close()
+
+        for r, result in zip(missing, computed):
+            results[r] = result
+            if caching:
+                _store(cache, simulationParameters, seeds[r], days, records, result,
+                       {'seed': seed, 'replicate': first + r, 'paired': paired}, paired)
+
+    if records:
+        return np.array([totals for totals, infections in results]), [infections for totals, infections in results]
+    return np.array(results)
+
+
+def runLocsimReplicate(template, seed, days, initialInfected=1):
+    '''Run one locsim replicate for days days, starting from initialInfected actors
+    infected from outside. Returns its transmission records (locsim.EVENT_DTYPE).
+    '''
+    rng = np.random.default_rng(seed)
+    simulation = template.instantiate(rng)
+    simulation.seed(rng.choice(simulation.graph.actorCnt, initialInfected, replace=False))
+    simulation.run(days)
+    return simulation.log.transmissions()
+
+
+def _locsimReplicate(handle, seed, days, initialInfected=1):
+    return runLocsimReplicate(_attach(handle, LocsimTemplate), seed, days, initialInfected)
+
+
+def runLocsimEnsemble(parameters, replicates, days, seed=None, workers=None, initialInfected=1, cacheDir=None):
+    '''Run replicates of a locsim scenario on a process pool (inline if workers == 1).
+
+    The population and contact graph are built once (cached in cacheDir, see
+    locsim.buildPopulation) and shared read-only with the workers. Returns the list
+    of the replicates' transmission records; records dropped by a replicate's event
+    log (see locsim.EventLog) are missing.
+    '''
+    if parameters.eventLogPath is not None:
+        raise ValueError('locsim ensembles keep their event logs in memory; set eventLogPath to None')
+    seeds = [replicateSeed(seed, r) for r in range(replicates)]
+    # without a seed there is nothing to cache the population under
+    template = LocsimTemplate(parameters, templateSeed(seed) if seed is not None else None, cacheDir)
+    if workers == 1:
+        return [runLocsimReplicate(template, s, days, initialInfected) for s in seeds]
+    handle = template.publish()
+    try:
+        with multiprocessing.get_context().Pool(workers) as pool:
+            return pool.starmap(_locsimReplicate, [(handle, s, days, initialInfected) for s in seeds])
+    finally:
+        template.close()
+
+
+def withOverrides(simulationParameters, overrides):
+    '''Copy of simulationParameters with overrides applied.
+
+    Keys are SimulationParameters attribute names, or 'variant.attribute' for
+    VariantParameters (e.g. 'omicron.transmissionRate').
+    '''
+    p = copy.deepcopy(simulationParameters)
+    for name, value in overrides.items():
+        if '.' in name:
+            variant, name = name.split('.', 1)
+            setattr(p.variantParameters[variant], name, value)
+        else:
+            setattr(p, name, value)
+    return p
+
+
+def runSweep(simulationParameters, points, replicates, days, seed=None, workers=None, cache=None):
+    '''runEnsemble for every point (a dict of overrides, see withOverrides) of a sweep.
+
+    Returns the totals, shape (len(points), replicates, days, len(TOTALS)).
+    '''
+    return np.array([runEnsemble(withOverrides(simulationParameters, point), replicates, days, seed, workers, cache)
+                     for point in points])
+
+
+# Outcome metrics of a replicate, from its totals
+METRICS = {
+    'peakInfected': lambda totals: totals[:, TOTALS.index('infected')].max(),
+    'deceased': lambda totals: totals[-1, TOTALS.index('deceased')],
+    'daysLost': lambda totals: totals[-1, TOTALS.index('daysLost')],
+    'testsConducted': lambda totals: totals[-1, TOTALS.index('testsConducted')],
+    'peakPcrQueue': lambda totals: totals[:, TOTALS.index('pcrQueue')].max(),
+    'peakPcrTurnaround': lambda totals: totals[:, TOTALS.index('pcrTurnaround')].max(),
+}
+
+
+def replicateMetrics(totals, metrics=tuple(METRICS)):
+    return np.array([METRICS[name](totals) for name in metrics])
+
+
+def confidenceInterval(values, confidence=0.95):
+    '''Mean and half-width of the Student t confidence interval, per column of values'''
+    from scipy.stats import t
+
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    mean = values.mean(axis=0)
+    if n < 2:
+        return mean, np.full(mean.shape, np.inf)
+    return mean, t.ppf(0.5 + confidence / 2, n - 1) * values.std(axis=0, ddof=1) / np.sqrt(n)
+
+
+class _Scenario:
+    def __init__(self, simulationParameters, seed):
+        self.parameters = simulationParameters
+        self.seed = seed
+        self.template = None
+        self.handle = None
+        self.issued = 0
+        self.results = {}
+        self.need = np.inf
+
+    def nextSeed(self):
+        self.issued += 1
+        return replicateSeed(self.seed, self.issued - 1)
+
+    def build(self):
+        if self.template is None:
+            self.template = PopulationTemplate(self.parameters, templateSeed(self.seed))
+        return self.template
+
+    def publish(self):
+        if self.handle is None:
+            self.handle = self.build().publish()
+        return self.handle
+
+
+def runAdaptive(scenarios, days, seed=None, precision=0.05, tolerance=1.0, confidence=0.95, batch=8,
+                maxReplicates=200, workers=None, cache=None, metrics=tuple(METRICS)):
+    '''Run every scenario until its metrics are known to the requested precision.
+
+    scenarios maps names to SimulationParameters. A scenario is done when, for every
+    metric, the confidence interval half-width is at most precision * |mean| (or
+    tolerance, whichever is larger), after at least batch replicates, or when it
+    reaches maxReplicates. Scenarios get replicates in batches; as workers free up
+    they go to the unfinished scenario furthest from its target precision.
+
+    Returns {name: {'totals', 'metrics': {metric: (mean, half-width)}, 'replicates', 'converged'}}.
+    '''
+    states = {name: _Scenario(p, seed) for name, p in scenarios.items()}
+    slots = workers or os.cpu_count()
+    executor = None if workers == 1 else ProcessPoolExecutor(slots, mp_context=multiprocessing.get_context())
+    running = {}
+
+    def update(state):
+        if len(state.results) >= batch:
+            mean, halfWidth = confidenceInterval([replicateMetrics(state.results[r], metrics)
+                                                  for r in sorted(state.results)], confidence)
+            state.need = np.max(halfWidth / np.maximum(precision * np.abs(mean), tolerance))
+
+    def wanted(state):
+        # replicates issued but not finished count against the current batch
+        inFlight = state.issued - len(state.results)
+        return state.need > 1 and state.issued < maxReplicates and inFlight < batch
+
+    def issue(name, state):
+        index = state.issued
+        s = state.nextSeed()
+        result = None
+        if cache is not None and seed is not None:
+            result = _cached(cache, state.parameters, s, days, False)
+        if result is not None:
+            state.results[index] = result
+            update(state)
+        elif executor is None:
+            state.results[index] = runReplicate(state.build(), s, days)
+            finish(state, index, s)
+        else:
+            running[executor.submit(_replicate, state.publish(), s, days)] = (name, index, s)
+
+    def finish(state, index, s):
+        if cache is not None and seed is not None:
+            _store(cache, state.parameters, s, days, False, state.results[index],
+                   {'seed': seed, 'replicate': index})
+        update(state)
+
+    try:
+        while True:
+            # fill free workers, furthest from target precision first
+            while len(running) < slots:
+                candidates = [(state.need, name) for name, state in states.items() if wanted(state)]
+                if not candidates:
+                    break
+                need, name = max(candidates, key=lambda candidate: candidate[0])
+                issue(name, states[name])
+            if not running:
+                if not any(wanted(state) for state in states.values()):
+                    break
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, index, s = running.pop(future)
+                states[name].results[index] = future.result()
+                finish(states[name], index, s)
+    finally:
+        if executor is not None:
+            for future in running:
+                future.cancel()
+            executor.shutdown()
+        for state in states.values():
+            if state.template is not None:
+                state.template.close()
+
+    summary = {}
+    for name, state in states.items():
+        totals = np.array([state.results[r] for r in sorted(state.results)])
+        mean, halfWidth = confidenceInterval([replicateMetrics(t, metrics) for t in totals], confidence)
+        summary[name] = {'totals': totals, 'replicates': len(totals), 'converged': bool(state.need <= 1),
+                         'metrics': {metric: (float(mean[i]), float(halfWidth[i])) for i, metric in enumerate(metrics)}}
+    return summary
+
+
+def runPaired(scenarios, replicates, days, seed=0, baseline=None, workers=None, cache=None, confidence=0.95,
+              metrics=tuple(METRICS)):
+    '''Compare scenarios with common random numbers.
+
+    Replicate r of every scenario runs with the same seed and named random
+    substreams (arraysim.PairedRandom), so the scenarios differ only through the
+    draws their differences touch, and the paired differences to the baseline
+    scenario (the first one by default) vary much less than independent runs would.
+
+    Returns {name: {'totals', 'difference', 'metrics': {metric: (mean difference, half-width)}}},
+    difference being totals minus the baseline's totals, replicate by replicate.
+    '''
+    baseline = next(iter(scenarios)) if baseline is None else baseline
+    totals = {name: runEnsemble(p, replicates, days, seed, workers, cache, paired=True)
+              for name, p in scenarios.items()}
+    reference = np.array([replicateMetrics(t, metrics) for t in totals[baseline]])
+    summary = {}
+    for name, runs in totals.items():
+        differences = np.array([replicateMetrics(t, metrics) for t in runs]) - reference
+        mean, halfWidth = confidenceInterval(differences, confidence)
+        summary[name] = {'totals': runs, 'difference': runs - totals[baseline],
+                         'metrics': {metric: (float(mean[i]), float(halfWidth[i])) for i, metric in enumerate(metrics)}}
+    return summary
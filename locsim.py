@@ -2,30 +2,34 @@ from math import sqrt
 from dataclasses import dataclass
 from enum import Enum,auto
 import random
-from functools import partial
-import scipy.stats
+from collections import deque
+import hashlib
+import os
+import numpy as np
 
 class Actor:
-    def __init__(self,simulation) -> None:
+    def __init__(self,simulation,age=None) -> None:
         self.simulation=simulation
         self.locationtimes=[]
-        self.age=self.simulation.parameters.ageRV()
+        self.age=self.simulation.parameters.ageRV() if age is None else age
         self.infected=False
         self.infectionHistory=[]
         self.transmissionHistory=[]
         self.id=0
 
-    def infect(self,infected,location=None,when=None):
+    # infected by infected (an Actor, e.g. simulation.externalActor) at location, or recovered
+    # if infected is None. The run state is kept by the simulation (see Simulation.seed).
+    def infect(self,infected,location=None):
         if infected is None:
-            self.infected=False
+            self.simulation._recovered(np.array([self.id],dtype=np.int64))
         else:
-            self.infected=True
-            if when is None:
-                when = self.simulation.timestamp
             assert location is not None,"infect requires a location"
-            self.infectionHistory.append((infected,location,when))
-            infected.transmissionHistory.append((self,location,when))
-            self.simulation.infected.append(self)
+            self.simulation.seed([self],infected,location)
+
+    def _infect(self,infected,location,when):
+        self.infected=True
+        self.infectionHistory.append((infected,location,when))
+        infected.transmissionHistory.append((self,location,when))
 
 
 
@@ -53,146 +57,655 @@ class Location:
         self.activity=activity
         self.density=density
         # todo: What is a reasonable number for sigma and should it be a parameter
-        self.pdf=scipy.stats.norm(0, sigma).pdf
+        self.sigma=sigma
         self.actors=[]
 
+    def pdf(self,x):
+        return _normpdf(x,self.sigma)
+
     def addActor(self,actor,interval):
         self.actors.append(actor)
         actor.locationtimes.append((self,interval))
 
+class LazyRV:
+    """rvs of a frozen scipy.stats distribution; scipy.stats is only imported on first draw."""
+    def __init__(self,name,*args) -> None:
+        self.name=name
+        self.args=args
+        self.frozen=None
+
+    def __call__(self,*args,**kwds):
+        if self.frozen is None:
+            import scipy.stats
+            self.frozen=getattr(scipy.stats,self.name)(*self.args)
+        return self.frozen.rvs(*args,**kwds)
+
+    def __repr__(self):
+        return f"LazyRV({self.name!r},{','.join(map(repr,self.args))})"
+
 @dataclass
 class SimulationParameters:
     populationSize:int = 10000
     dayInterval=0.4
     nightInterval=0.5
-    homeSizeRV=partial(scipy.stats.norm(2,1).rvs)
-    workGroupSizeRV=partial(scipy.stats.norm(15,5).rvs)
-    workGroupCntRV=partial(scipy.stats.norm(3,10).rvs)
-    schoolClassSizeRV=partial(scipy.stats.norm(25,10).rvs)
-    schoolClassCntRV=partial(scipy.stats.norm(25,10).rvs)
-    ageRV=partial(scipy.stats.uniform(1,80).rvs)
+    homeSizeRV=LazyRV("norm",2,1)
+    workGroupSizeRV=LazyRV("norm",15,5)
+    workGroupCntRV=LazyRV("norm",3,10)
+    schoolClassSizeRV=LazyRV("norm",25,10)
+    schoolClassCntRV=LazyRV("norm",25,10)
+    ageRV=LazyRV("uniform",1,80)
+    # 0: no per-event text output, 1: print every transmission
+    verbosity:int = 0
+    # number of records held in memory before the event log is flushed (or wraps)
+    eventLogCapacity:int = 1<<16
+    # file the event log is flushed to; None keeps only the last eventLogCapacity records
+    eventLogPath:str = None
+    # days an actor stays infectious; None keeps actors infectious for the whole run
+    infectiousPeriod:float = None
+
+def _ranges(starts,counts):
+    # concatenated np.arange(start,start+count) for every (start,count) pair
+    counts=np.asarray(counts,dtype=np.int64)
+    total=int(counts.sum())
+    if total == 0:
+        return np.zeros(0,dtype=np.int64)
+    ends=np.cumsum(counts)
+    offsets=np.repeat(ends-counts,counts)
+    return np.repeat(np.asarray(starts,dtype=np.int64),counts)+np.arange(total)-offsets
+
+def _normpdf(x,sigma):
+    # same as scipy.stats.norm(0,sigma).pdf(x), evaluated for whole arrays
+    return np.exp(-0.5*(x/sigma)**2)/(sigma*sqrt(2*np.pi))
+
+class ContactGraph:
+    """Sparse (CSR) form of the actor x location membership of a built population.
+
+    Actor-major rows hold, for every actor, the locations it belongs to with the
+    membership interval and its slot (position) within that location.
+    Location-major rows hold the members of every location in slot order, so the
+    slot of an entry is its offset from the start of the row.
+    Memory is linear in the number of memberships.
+    """
+    def __init__(self,actorCnt,actor,location,interval,slot,sigma,density) -> None:
+        actor=np.asarray(actor,dtype=np.int64)
+        location=np.asarray(location,dtype=np.int64)
+        interval=np.asarray(interval,dtype=np.float64)
+        slot=np.asarray(slot,dtype=np.int64)
+        self.actorCnt=actorCnt
+        self.locationCnt=len(sigma)
+        self.sigma=np.asarray(sigma,dtype=np.float64)
+        self.density=np.asarray(density,dtype=np.float64)
+
+        order=np.lexsort((location,actor))
+        self.actorPtr=np.zeros(actorCnt+1,dtype=np.int64)
+        np.cumsum(np.bincount(actor,minlength=actorCnt),out=self.actorPtr[1:])
+        self.actorLocation=location[order]
+        self.actorInterval=interval[order]
+        self.actorSlot=slot[order]
+
+        order=np.lexsort((slot,location))
+        self.locationPtr=np.zeros(self.locationCnt+1,dtype=np.int64)
+        np.cumsum(np.bincount(location,minlength=self.locationCnt),out=self.locationPtr[1:])
+        self.locationActor=actor[order]
+        self.locationInterval=interval[order]
+        assert np.array_equal(slot[order],np.arange(len(order))-np.repeat(self.locationPtr[:-1],np.diff(self.locationPtr))), \
+            "location slots must be 0..n-1"
+
+    @classmethod
+    def fromSimulation(cls,simulation):
+        actor,location,interval,slot=[],[],[],[]
+        for loc in simulation.locations:
+            for sidx,member in enumerate(loc.actors):
+                for tmp,minterval in member.locationtimes:
+                    if tmp is loc:
+                        break
+                actor.append(member.id)
+                location.append(loc.id)
+                interval.append(minterval)
+                slot.append(sidx)
+        return cls(len(simulation.actors),actor,location,interval,slot,
+                   [loc.sigma for loc in simulation.locations],
+                   [loc.density for loc in simulation.locations])
+
+    @classmethod
+    def fromPopulation(cls,population):
+        return cls(population.actorCnt,population.actor,population.location,population.interval,
+                   population.slot,population.sigma,population.density)
+
+    fields=("actorPtr","actorLocation","actorInterval","actorSlot",
+            "locationPtr","locationActor","locationInterval","sigma","density")
+
+    def arrays(self):
+        return {name:getattr(self,name) for name in self.fields}
+
+    # graph over already compiled arrays (e.g. attached read-only from template.publishArrays)
+    @classmethod
+    def fromArrays(cls,arrays):
+        graph=cls.__new__(cls)
+        for name in cls.fields:
+            setattr(graph,name,arrays[name])
+        graph.actorCnt=len(graph.actorPtr)-1
+        graph.locationCnt=len(graph.locationPtr)-1
+        return graph
+
+    def locationSize(self,location):
+        return self.locationPtr[location+1]-self.locationPtr[location]
+
+    def contacts(self,infected,susceptibleMask,rng=np.random):
+        """One contact sweep over the rows of the infected actors.
+
+        infected is an array of infected actor ids, susceptibleMask a boolean array over
+        all actors. Returns parallel arrays (infector, infectee, location, islot, sslot,
+        p, interval) with one entry per sampled contact with a susceptible actor.
+        """
+        infected=np.asarray(infected,dtype=np.int64)
+        counts=self.actorPtr[infected+1]-self.actorPtr[infected]
+        entries=_ranges(self.actorPtr[infected],counts)
+        return self._contacts(np.repeat(infected,counts),self.actorLocation[entries],
+                              self.actorSlot[entries],self.actorInterval[entries],susceptibleMask,rng)
+
+    def locationContacts(self,locations,infectedMask,susceptibleMask,rng=np.random):
+        """Same as contacts, but driven by a set of locations: only the infected members
+        of those locations are swept, and only within those locations.
+        """
+        locations=np.asarray(locations,dtype=np.int64)
+        sizes=self.locationSize(locations)
+        members=_ranges(self.locationPtr[locations],sizes)
+        infected=infectedMask[self.locationActor[members]]
+        members=members[infected]
+        location=np.repeat(locations,sizes)[infected]
+        return self._contacts(self.locationActor[members],location,members-self.locationPtr[location],
+                              self.locationInterval[members],susceptibleMask,rng)
+
+    def _contacts(self,infector,location,islot,iinterval,susceptibleMask,rng):
+        # expand every (infector,location) entry over the members of the location
+        sizes=self.locationSize(location)
+        members=_ranges(self.locationPtr[location],sizes)
+        infectee=self.locationActor[members]
+        sslot=members-np.repeat(self.locationPtr[location],sizes)
+        infector=np.repeat(infector,sizes)
+        location=np.repeat(location,sizes)
+        islot=np.repeat(islot,sizes)
+        iinterval=np.repeat(iinterval,sizes)
+
+        # technically you might infect with a new variant, but simplify for now
+        keep=susceptibleMask[infectee]
+        infector,infectee,location=infector[keep],infectee[keep],location[keep]
+        islot,sslot=islot[keep],sslot[keep]
+        sinterval=self.locationInterval[members[keep]]
+        iinterval=iinterval[keep]
+
+        p=_normpdf(np.abs(islot-sslot)*self.density[location],self.sigma[location])
+        contact=rng.random(len(p))<p
+        #estimate time overlap
+        interval=np.sqrt(iinterval[contact]*sinterval[contact])
+        return (infector[contact],infectee[contact],location[contact],
+                islot[contact],sslot[contact],p[contact],interval)
+
+
+class Population:
+    """Array form of a synthetic population as emitted by buildPopulation.
+
+    age is per actor; activity (index into Activities), sigma and density are per
+    location; actor, location, interval and slot are parallel membership arrays.
+    """
+    fields=("age","activity","sigma","density","actor","location","interval","slot")
+
+    def __init__(self,**arrays) -> None:
+        for name in self.fields:
+            setattr(self,name,arrays[name])
+
+    @property
+    def actorCnt(self):
+        return len(self.age)
+
+    @property
+    def locationCnt(self):
+        return len(self.activity)
+
+    def save(self,path):
+        np.savez(path,**{name:getattr(self,name) for name in self.fields})
+
+    @classmethod
+    def load(cls,path):
+        with np.load(path) as data:
+            return cls(**{name:data[name] for name in cls.fields})
+
+def _rvKey(rv):
+    if isinstance(rv,LazyRV):
+        return (rv.name,rv.args,[])
+    # frozen scipy distributions are wrapped in a partial of their bound rvs
+    frozen=getattr(getattr(rv,"func",rv),"__self__",None)
+    if frozen is None or not hasattr(frozen,"dist"):
+        return repr(rv)
+    return (frozen.dist.name,frozen.args,sorted(frozen.kwds.items()))
+
+def populationKey(parameters,seed):
+    key=(1,parameters.populationSize,parameters.dayInterval,parameters.nightInterval,
+         _rvKey(parameters.homeSizeRV),_rvKey(parameters.workGroupSizeRV),_rvKey(parameters.workGroupCntRV),
+         _rvKey(parameters.schoolClassSizeRV),_rvKey(parameters.schoolClassCntRV),_rvKey(parameters.ageRV),seed)
+    return hashlib.sha256(repr(key).encode()).hexdigest()[:24]
+
+def _cover(draw,total,minimum):
+    # draw integer group sizes (each >= minimum) until they cover total; the last group is truncated
+    if total <= 0:
+        return np.zeros(0,dtype=np.int64)
+    batches=[]
+    covered=0
+    while covered < total:
+        batches.append(draw(max(16,(total-covered)//minimum)))
+        covered+=int(batches[-1].sum())
+    sizes=np.concatenate(batches)
+    sizes=sizes[:int(np.searchsorted(np.cumsum(sizes),total))+1]
+    sizes[-1]-=sizes.sum()-total
+    return sizes
+
+def _groupSizes(rv,total,rng,minimum):
+    # group sizes are max(minimum,int(rv())) as in the original builder loops
+    return _cover(lambda k:np.maximum(minimum,np.asarray(rv(size=k,random_state=rng)).astype(np.int64)),total,minimum)
+
+def _sites(rv,groups,rng,firstLocation):
+    # lay out each site as its admin location followed by its groups.
+    # returns (admin location per site, group location per group, site per group, index within site)
+    # a site keeps taking groups while its sampled count is positive, so it gets max(1,ceil(rv()))
+    perSite=_cover(lambda k:np.maximum(1,np.ceil(np.asarray(rv(size=k,random_state=rng)))).astype(np.int64),groups,1)
+    base=firstLocation+np.cumsum(perSite+1)-(perSite+1)
+    site=np.repeat(np.arange(len(perSite)),perSite)
+    within=np.arange(groups)-np.repeat(np.cumsum(perSite)-perSite,perSite)
+    return base,base[site]+1+within,site,within
+
+def buildPopulation(parameters,seed=None,cacheDir=None):
+    """Sample a whole synthetic town (homes, school classes, workgroups) as arrays.
+
+    Mirrors the layout of the original Simulation builder: everyone is assigned to a
+    home in order, shuffled kids fill classrooms (each with an adult teacher who is also
+    on the school admin team), and the remaining shuffled adults fill workgroups, each
+    with a manager on the workplace admin team.
+    If cacheDir is given and seed is not None, the population is loaded from / stored
+    to an .npz file keyed by the parameters and the seed.
+    """
+    path=None
+    if cacheDir is not None and seed is not None:
+        path=os.path.join(cacheDir,f"population-{populationKey(parameters,seed)}.npz")
+        if os.path.exists(path):
+            return Population.load(path)
+
+    rng=np.random.default_rng(seed)
+    n=parameters.populationSize
+    activities=list(Activities)
+    age=np.asarray(parameters.ageRV(size=n,random_state=rng),dtype=np.float64)
+    adults=rng.permutation(np.flatnonzero(age>18))
+    kids=rng.permutation(np.flatnonzero(age<=18))
+
+    actor,location,interval,slot=[],[],[],[]
+    activity,sigma=[],[]
+    def emit(a,l,t,s):
+        actor.append(a)
+        location.append(l)
+        interval.append(np.broadcast_to(np.float64(t),len(a)))
+        slot.append(s)
+
+    # assign everyone to a home
+    sizes=_groupSizes(parameters.homeSizeRV,n,rng,1)
+    home=np.repeat(np.arange(len(sizes)),sizes)
+    emit(np.arange(n),home,parameters.nightInterval,np.arange(n)-np.repeat(np.cumsum(sizes)-sizes,sizes))
+    activity.append(np.full(len(sizes),activities.index(Activities.Home)))
+    sigma.append(np.full(len(sizes),10.0))
+    locationCnt=len(sizes)
+
+    # assign kids to school during the day, one teacher per classroom
+    sizes=_groupSizes(parameters.schoolClassSizeRV,len(kids),rng,2)[:len(adults)]
+    classes=len(sizes)
+    admin,room,school,within=_sites(parameters.schoolClassCntRV,classes,rng,locationCnt)
+    teachers=adults[:classes]
+    emit(teachers,room,parameters.dayInterval/2,np.zeros(classes,dtype=np.int64))
+    emit(teachers,admin[school],parameters.dayInterval/2,within)
+    pupils=np.repeat(np.arange(classes),sizes)
+    emit(kids[:len(pupils)],room[pupils],parameters.dayInterval,1+np.arange(len(pupils))-np.repeat(np.cumsum(sizes)-sizes,sizes))
+    codes=np.full(len(admin)+classes,activities.index(Activities.School))
+    codes[admin-locationCnt]=activities.index(Activities.SchoolAdmin)
+    activity.append(codes)
+    sigma.append(np.where(codes==activities.index(Activities.School),100.0,10.0))
+    locationCnt+=len(codes)
+
+    # assign the remaining adults to workgroups, each with a manager
+    workers=adults[classes:]
+    sizes=_cover(lambda k:1+np.maximum(2,np.asarray(parameters.workGroupSizeRV(size=k,random_state=rng)).astype(np.int64)),
+                 len(workers),3)
+    groups=len(sizes)
+    admin,room,site,within=_sites(parameters.workGroupCntRV,groups,rng,locationCnt)
+    first=np.cumsum(sizes)-sizes
+    managers=workers[first]
+    emit(managers,room,parameters.dayInterval/2,np.zeros(groups,dtype=np.int64))
+    emit(managers,admin[site],parameters.dayInterval/2,within)
+    member=np.ones(len(workers),dtype=bool)
+    member[first]=False
+    group=np.repeat(np.arange(groups),sizes)
+    emit(workers[member],room[group[member]],parameters.dayInterval,(np.arange(len(workers))-first[group])[member])
+    codes=np.full(len(admin)+groups,activities.index(Activities.Work))
+    codes[admin-locationCnt]=activities.index(Activities.Admin)
+    activity.append(codes)
+    sigma.append(np.full(len(codes),10.0))
+
+    activity=np.concatenate(activity).astype(np.int8)
+    population=Population(age=age,activity=activity,sigma=np.concatenate(sigma),density=np.ones(len(activity)),
+                          actor=np.concatenate(actor).astype(np.int64),location=np.concatenate(location).astype(np.int64),
+                          interval=np.concatenate(interval),slot=np.concatenate(slot).astype(np.int64))
+    if path is not None:
+        os.makedirs(cacheDir,exist_ok=True)
+        population.save(path)
+    return population
+
+
+class EventKind:
+    CONTACT=0
+    TRANSMISSION=1
+
+EVENT_DTYPE=np.dtype([("time","f8"),("location","i4"),("activity","i1"),("kind","i1"),
+                      ("infector","i4"),("infectee","i4"),("distance","i4"),("probability","f4")])
+
+def readEvents(path):
+    return np.fromfile(path,dtype=EVENT_DTYPE)
+
+class EventLog:
+    """Fixed-width contact/transmission records held in a preallocated ring buffer.
+
+    When the buffer fills up it is appended in bulk to path (raw EVENT_DTYPE
+    records, see readEvents); without a path the oldest records are overwritten
+    and counted in dropped.
+    """
+    def __init__(self,capacity=1<<16,path=None) -> None:
+        self.buffer=np.zeros(capacity,dtype=EVENT_DTYPE)
+        self.path=path
+        self.start=0
+        self.count=0
+        self.dropped=0
+        self.flushed=0
+        if path is not None:
+            open(path,"wb").close()
+
+    def __len__(self):
+        return self.flushed+self.count
+
+    def record(self,kind,time,location,activity,infector,infectee,distance,probability):
+        records=np.zeros(len(np.atleast_1d(infectee)),dtype=EVENT_DTYPE)
+        records["time"]=time
+        records["location"]=location
+        records["activity"]=activity
+        records["kind"]=kind
+        records["infector"]=infector
+        records["infectee"]=infectee
+        records["distance"]=distance
+        records["probability"]=probability
+        self.append(records)
+
+    def append(self,records):
+        capacity=len(self.buffer)
+        while len(records):
+            if self.count == capacity:
+                if self.path is not None:
+                    self.flush()
+                else:
+                    drop=min(len(records),capacity)
+                    self.start=(self.start+drop)%capacity
+                    self.count-=drop
+                    self.dropped+=drop
+            end=(self.start+self.count)%capacity
+            n=min(len(records),capacity-self.count,capacity-end)
+            self.buffer[end:end+n]=records[:n]
+            self.count+=n
+            records=records[n:]
+
+    def _buffered(self):
+        idx=(self.start+np.arange(self.count))%len(self.buffer)
+        return self.buffer[idx]
+
+    def flush(self):
+        if self.path is None or self.count == 0:
+            return
+        with open(self.path,"ab") as f:
+            self._buffered().tofile(f)
+        self.flushed+=self.count
+        self.start=0
+        self.count=0
+
+    def records(self):
+        if self.path is None or self.flushed == 0:
+            return self._buffered()
+        return np.concatenate([readEvents(self.path),self._buffered()])
+
+    def transmissions(self):
+        records=self.records()
+        return records[records["kind"]==EventKind.TRANSMISSION]
+
+def transmissionTree(transmissions):
+    """Index transmission records by infector.
+
+    Returns (infectors, ptr, order): the transmissions of infectors[k] are
+    transmissions[order[ptr[k]:ptr[k+1]]], in time order.
+    """
+    order=np.lexsort((transmissions["time"],transmissions["infector"]))
+    infectors,counts=np.unique(transmissions["infector"][order],return_counts=True)
+    ptr=np.zeros(len(infectors)+1,dtype=np.int64)
+    np.cumsum(counts,out=ptr[1:])
+    return infectors,ptr,order
+
+def transmissionDump(log,root=-1):
+    transmissions=log.transmissions()
+    infectors,ptr,order=transmissionTree(transmissions)
+    activities=list(Activities)
+
+    def children(infector,after):
+        k=np.searchsorted(infectors,infector)
+        if k == len(infectors) or infectors[k] != infector:
+            return []
+        idx=order[ptr[k]:ptr[k+1]]
+        return idx[transmissions["time"][idx]>after][::-1].tolist()
+
+    # depth first, printed in the same layout as the old recursive dump
+    stack=[(i,0) for i in children(root,-np.inf)]
+    while stack:
+        i,depth=stack.pop()
+        event=transmissions[i]
+        indent="   "*depth
+        print(f"{activities[event['activity']].name:10}, {event['location']:5d}, {event['time']:8.4f}, {indent} {event['infectee']:6d}")
+        stack.extend((j,depth+1) for j in children(event["infectee"],event["time"]))
 
 
 class Simulation:
-    def __init__(self,parameters) -> None:
+    # population and graph may be shared between replicates (see template.py); they are only read.
+    # The run itself only uses the graph, the masks and the event log; the Actor and Location
+    # objects are built on first use of actors/locations (verbosity, selftests) and kept up to date
+    # from then on. Contacts are drawn from rng (a numpy Generator), by default the global numpy state.
+    def __init__(self,parameters,population=None,graph=None,rng=None) -> None:
         self.parameters=parameters
-        self.actors=[]
-        self.locations=[]
-        self.infected=[]
-        self.externalActor=Actor(self)
+        self.rng=np.random if rng is None else rng
+        self._actors=None
+        self._locations=None
+        self.externalActor=Actor(self,age=0)
+        self.externalActor.id=-1
         self.externalLocation=Location(Activities.External)
         self.timestamp=0.0
+        self.log=EventLog(parameters.eventLogCapacity,parameters.eventLogPath)
+
+        if population is None:
+            population=buildPopulation(parameters)
+        self.population=population
+
+        self.graph=graph if graph is not None else ContactGraph.fromPopulation(population)
+        self.activity=population.activity
+        self.home=self.activity==list(Activities).index(Activities.Home)
 
-        # generate actors
-        for n in range(self.parameters.populationSize):
-            actor=Actor(self)
-            self.actors.append(actor)
-
-        # assign everyone to a home
-        aiter=iter(self.actors)
-        try:
-            while True:
-                self.locations.append(Location(Activities.Home))
-                for n in range(max(1,int(self.parameters.homeSizeRV()))):
-                    actor=next(aiter)
-                    self.locations[-1].addActor(actor,self.parameters.nightInterval)
-        except StopIteration:
-            pass
-
-        # assign jobs to adults
-        adults=list(filter(lambda x: x.age>18,self.actors))
-        random.shuffle(adults)
-        aiter=iter(adults)
-
-        # assign kids to school during the day
-        kids=list(filter(lambda x: x.age<=18,self.actors))
-        random.shuffle(kids)
-        kiter=iter(kids)
-        schoolClassCnt=0
-        try:
-            while True:                 
-                if schoolClassCnt <= 0:
-                    #create a new school 
-                    admin=Location(Activities.SchoolAdmin)
-                    self.locations.append(admin)
-                    schoolClassCnt=self.parameters.schoolClassCntRV()
-                schoolClassCnt-=1
-                
-                #create a classroom
-                self.locations.append(Location(Activities.School,sigma=100))
-                # assign a teacher
-                teacher=next(aiter)
-                self.locations[-1].addActor(teacher,self.parameters.dayInterval/2)
-                admin.addActor(teacher,self.parameters.dayInterval/2)  
-                for n in range(max(2,int(self.parameters.schoolClassSizeRV()))):
-                    actor=next(kiter)
-                    self.locations[-1].addActor(actor,self.parameters.dayInterval)
-        except StopIteration:
-            pass
-
-        # assign everyone someplace to go during the day
-        # work management team
-        workgroupCnt=0
-        try:
-            while True:
-                #create a new work place (collection of workgroup locations)
-                if workgroupCnt <= 0:
-                    admin=Location(Activities.Admin)
-                    self.locations.append(admin)
-                    workgroupCnt=self.parameters.workGroupCntRV()
-
-                # create a new workgroup location
-                workgroupCnt-=1
-                self.locations.append(Location(Activities.Work,sigma=10))
-
-                # assign a manager to group and admin team
-                manager=next(aiter)
-                self.locations[-1].addActor(manager,self.parameters.dayInterval/2)
-                admin.addActor(manager,self.parameters.dayInterval/2)  
-                for n in range(max(2,int(self.parameters.workGroupSizeRV()))):
-                    actor=next(aiter)
-                    self.locations[-1].addActor(actor,self.parameters.dayInterval)
-        except StopIteration:
-            pass
-
-        for id,actor in enumerate(self.actors):
+        # active location index: number of infectious members per location, and the
+        # locations where that number is positive
+        self.infectedMask=np.zeros(self.graph.actorCnt,dtype=bool)
+        self.susceptibleMask=np.ones(self.graph.actorCnt,dtype=bool)
+        self.infectiousCount=np.zeros(self.graph.locationCnt,dtype=np.int32)
+        self.activeLocations=set()
+        # (infection time, actor ids) batches, in infection time order
+        self.recoveries=deque()
+        # ids of the infected actors in infection order (may include recovered ones)
+        self.infectedIds=[]
+        if self.parameters.verbosity >= 1:
+            self._buildObjects()
+
+    @property
+    def actors(self):
+        if self._actors is None:
+            self._buildObjects()
+        return self._actors
+
+    @property
+    def locations(self):
+        if self._locations is None:
+            self._buildObjects()
+        return self._locations
+
+    @property
+    def infected(self):
+        return [self.actors[id] for id in self._infectedRows().tolist()]
+
+    def _buildObjects(self):
+        # generate actors and locations
+        population=self.population
+        activities=list(Activities)
+        actors=[Actor(self,age) for age in population.age.tolist()]
+        locations=[Location(activities[activity],density,sigma) for activity,density,sigma in
+                   zip(population.activity.tolist(),population.density.tolist(),population.sigma.tolist())]
+        order=np.lexsort((population.slot,population.location))
+        for actor,location,interval in zip(population.actor[order].tolist(),population.location[order].tolist(),
+                                           population.interval[order].tolist()):
+            locations[location].addActor(actors[actor],interval)
+
+        for id,actor in enumerate(actors):
             actor.id=id
-        for id,location in enumerate(self.locations):
+        for id,location in enumerate(locations):
             location.id=id
+        self._actors,self._locations=actors,locations
+
+        # catch up with the run so far; histories come from the event log, so
+        # transmissions it has dropped (see EventLog) are missing from them
+        events=self.log.transmissions()
+        for when,location,infector,infectee in zip(events["time"].tolist(),events["location"].tolist(),
+                                                   events["infector"].tolist(),events["infectee"].tolist()):
+            infector=self.externalActor if infector < 0 else actors[infector]
+            location=self.externalLocation if location < 0 else locations[location]
+            actors[infectee].infectionHistory.append((infector,location,when))
+            infector.transmissionHistory.append((actors[infectee],location,when))
+        for id in np.flatnonzero(self.infectedMask).tolist():
+            actors[id].infected=True
+
+    def _infectedRows(self):
+        # infected actors in infection order
+        if not self.infectedIds:
+            return np.zeros(0,dtype=np.int64)
+        rows=np.concatenate(self.infectedIds)
+        return rows[self.infectedMask[rows]]
+
+    def _updateActive(self,ids,delta):
+        counts=self.graph.actorPtr[ids+1]-self.graph.actorPtr[ids]
+        locations,cnt=np.unique(self.graph.actorLocation[_ranges(self.graph.actorPtr[ids],counts)],return_counts=True)
+        before=self.infectiousCount[locations]
+        self.infectiousCount[locations]+=delta*cnt
+        if delta > 0:
+            self.activeLocations.update(locations[before==0].tolist())
+        else:
+            self.activeLocations.difference_update(locations[self.infectiousCount[locations]==0].tolist())
+
+    def _infected(self,ids):
+        ids=np.asarray(ids,dtype=np.int64)
+        self.infectedIds.append(ids)
+        self.infectedMask[ids]=True
+        self.susceptibleMask[ids]=False
+        self._updateActive(ids,1)
+        if self.parameters.infectiousPeriod is not None:
+            self.recoveries.append((self.timestamp,ids))
+
+    # actors infectious for longer than infectiousPeriod recover, and are not infected again
+    def recover(self):
+        while self.recoveries and self.recoveries[0][0]+self.parameters.infectiousPeriod <= self.timestamp:
+            _,ids=self.recoveries.popleft()
+            self._recovered(ids)
+
+    def _recovered(self,ids):
+        ids=ids[self.infectedMask[ids]]
+        if self._actors is not None:
+            for id in ids.tolist():
+                self._actors[id].infected=False
+        self.infectedMask[ids]=False
+        self._updateActive(ids,-1)
+
+    # infect actors (Actor objects or ids) by infector at location, by default from outside the
+    # population; actors that are not susceptible (already infected or recovered) and repeated
+    # ones are skipped
+    def seed(self,actors,infector=None,location=None):
+        infector=self.externalActor if infector is None else infector
+        location=self.externalLocation if location is None else location
+        ids=np.asarray([getattr(actor,"id",actor) for actor in actors],dtype=np.int64)
+        _,first=np.unique(ids,return_index=True)
+        ids=ids[np.sort(first)]
+        ids=ids[self.susceptibleMask[ids]]
+        if self._actors is not None:
+            for id in ids.tolist():
+                self._actors[id]._infect(infector,location,self.timestamp)
+        self.log.record(EventKind.TRANSMISSION,self.timestamp,location.id,
+                        list(Activities).index(location.activity),infector.id,ids,0,1.0)
+        self._infected(ids)
+
+    def _transmit(self,infector,infectee,location,islot,sslot,p,interval,transmit):
+        distance=np.abs(sslot-islot)
+        self.log.record(EventKind.CONTACT,self.timestamp,location,self.activity[location],
+                        infector,infectee,distance,p)
+
+        # an actor contacted by several infected actors in the same sweep is infected once
+        _,first=np.unique(np.where(transmit,infectee,-1),return_index=True)
+        first=np.sort(first[transmit[first]])
+        self.log.record(EventKind.TRANSMISSION,self.timestamp,location[first],self.activity[location[first]],
+                        infector[first],infectee[first],distance[first],p[first])
+        if self._actors is not None:
+            for n in first:
+                infected=self._actors[infector[n]]
+                susceptible=self._actors[infectee[n]]
+                loc=self._locations[location[n]]
+                if self.parameters.verbosity >= 1:
+                    print(f"contact {p[n]:10.5f} {loc.activity}:{loc.id} Actor {infected.id} @{islot[n]} to {susceptible.id} @{sslot[n]} dist {distance[n]}/{len(loc.actors)} times {interval[n]}")
+                susceptible._infect(infected,loc,self.timestamp)
+        self._infected(infectee[first])
 
     # test for close contact
     # for each infected person in each location, check for contact biased by
     # gaussian (distance of 2d Uniform distribution)
     def checkContact(self):
-        cleanup=0
-        for infected in self.infected:
-            if not infected.infected:
-                cleanup+=1
-                continue
-            for loc,iinterval in infected.locationtimes:
-                iidx=loc.actors.index(infected)
-                for sidx,susceptible in enumerate(loc.actors):
-                    # technically you might infect with a new variant, but simplify for now
-                    if susceptible.infected:  
-                        continue
-                    p=loc.pdf(abs(iidx-sidx)*loc.density)
-                    contact=random.random()<p
-                    if(contact):
-                        for tmp,sinterval in susceptible.locationtimes:
-                            if tmp == loc:
-                                break
-                        else:
-                            assert "location not in susceptibles locationtime list"
-
-                        #estimate time overlap
-                        interval=sqrt(iinterval*sinterval)
-
-                        print(f"contact {p:10.5f} {loc.activity}:{loc.id} Actor {infected.id} @{iidx} to {susceptible.id} @{sidx} dist {abs(sidx-iidx)}/{len(loc.actors)} times {interval} {sinterval}")
-                        susceptible.infect(infected,loc)
-
-        # now that we are done iterating on infected, remove actors that are nolonger infected
-        if cleanup > 100:
-            self.infected=[actor for actor in self.infected if actor.infected]
+        rows=self._infectedRows()
+        self.infectedIds=[rows]
+        contacts=self.graph.contacts(rows,self.susceptibleMask,self.rng)
+        self._transmit(*contacts,np.ones(len(contacts[0]),dtype=bool))
+
+    # contacts within the active locations of one phase (home or not home) of the day.
+    # a contact transmits with the probability that the two members overlap over the phase.
+    def contactPhase(self,home,length):
+        active=np.fromiter(self.activeLocations,dtype=np.int64,count=len(self.activeLocations))
+        active=active[self.home[active]==home]
+        contacts=self.graph.locationContacts(active,self.infectedMask,self.susceptibleMask,self.rng)
+        interval=contacts[-1]
+        self._transmit(*contacts,self.rng.random(len(interval))<np.minimum(1.0,interval/length))
+
+    # one day: the night phase at home followed by the day phase at school/work/admin
+    def tick(self):
+        start=self.timestamp
+        self.recover()
+        self.contactPhase(True,self.parameters.nightInterval)
+        self.timestamp=start+self.parameters.nightInterval
+        self.recover()
+        self.contactPhase(False,self.parameters.dayInterval)
+        self.timestamp=start+1.0
+
+    # days ticks; afterwards the event log file (eventLogPath) holds every record so far
+    def run(self,days):
+        for day in range(days):
+            self.tick()
+        self.log.flush()
+
 
 def selftests(simulation):
     for actor in simulation.actors:
@@ -206,24 +719,16 @@ def selftests(simulation):
     #randomly infect some actors
 
     for actor in random.choices(simulation.actors,k=1):
-        actor.infect(simulation.externalActor,simulation.externalLocation)
+        simulation.seed([actor])
         print(f"Infect {actor.id}")
 
-    for i in range(4):
-        simulation.timestamp+=1
-        simulation.checkContact()
-
-    def transmissionDump(actor,depth=0):
-        if len(actor.transmissionHistory) == 0:
-            return
-        indent="   "*depth
-        for other,oloc,otime in actor.transmissionHistory:
-            print(f"{oloc.activity.name:10}, {oloc.id:5d}, {otime:8.4f}, {indent} {other.id:6d}")
-            transmissionDump(other,depth+1)
+    simulation.run(4)
 
-    transmissionDump(simulation.externalActor)
+    transmissionDump(simulation.log)
 
-parameters=SimulationParameters()
-parameters.populationSize=100
-simulation=Simulation(parameters)
-selftests(simulation)
\ No newline at end of file
+if __name__ == "__main__":
+    parameters=SimulationParameters()
+    parameters.populationSize=100
+    parameters.verbosity=1
+    simulation=Simulation(parameters)
+    selftests(simulation)
\ No newline at end of file
@@ -0,0 +1,71 @@
+import heapq
+from collections import deque
+
+# PCR lab. Samples wait in a first in, first out queue and the lab processes at most
+# capacity of them a day; each processed batch's results come back resultDelay days
+# later through a timed event queue (a heap by due time). Work per tick is
+# proportional to the samples processed and the results due, not to the population.
+# Batches are whatever sequences the engine submits: lists (Simulation) or arrays
+# (the array engines).
+
+
+class PcrLab:
+    '''Capacity limited PCR processing.
+
+    capacity is the samples processed per day (None for unlimited). history holds
+    (clock, queue length, samples processed, mean turnaround) per process() call,
+    turnaround being the days from sample to result.
+    '''
+
+    def __init__(self, capacity=None, resultDelay=0.0):
+        self.capacity = capacity
+        self.resultDelay = resultDelay
+        self.queue = deque()
+        self.queued = 0
+        self.credit = 0.0
+        self.results = []
+        self.sequence = 0
+        self.turnaround = 0.0
+        self.history = []
+
+    def submit(self, clock, ids, positive, isolate):
+        '''Queue the samples of actors ids taken at clock, with their results
+        (positive) and whether a positive actor will isolate'''
+        if len(ids):
+            self.queue.append((clock, ids, positive, isolate))
+            self.queued += len(ids)
+
+    def process(self, clock, days=1.0):
+        '''Process the day's samples, oldest first'''
+        if self.capacity is None:
+            budget = self.queued
+        else:
+            # fractional capacity carries over to the next day, unused whole samples don't
+            self.credit += self.capacity * days
+            budget = min(int(self.credit), self.queued)
+            self.credit = (self.credit - budget) % 1.0
+        processed = 0
+        waited = 0.0
+        due = clock + self.resultDelay
+        while budget > 0:
+            sampled, ids, positive, isolate = self.queue.popleft()
+            if len(ids) > budget:
+                self.queue.appendleft((sampled, ids[budget:], positive[budget:], isolate[budget:]))
+                ids, positive, isolate = ids[:budget], positive[:budget], isolate[:budget]
+            heapq.heappush(self.results, (due, self.sequence, ids, positive, isolate))
+            self.sequence += 1
+            budget -= len(ids)
+            processed += len(ids)
+            waited += (due - sampled) * len(ids)
+        self.queued -= processed
+        if processed:
+            self.turnaround = waited / processed
+        self.history.append((clock, self.queued, processed, waited / processed if processed else 0.0))
+
+    def due(self, until):
+        '''(ids, positive, isolate) batches of the results due by until'''
+        batches = []
+        while self.results and self.results[0][0] <= until + 1e-9:
+            due, sequence, ids, positive, isolate = heapq.heappop(self.results)
+            batches.append((ids, positive, isolate))
+        return batches
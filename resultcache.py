@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import numpy as np
+
+# Content-addressed on-disk cache of simulation results. An entry is keyed by a hash
+# of the normalized SimulationParameters (every VariantParameters included), the
+# seed, the horizon and the version of the simulation code, and holds the per-tick
+# totals and, optionally, the infection records in one .npz file.
+
+# Modules whose source defines the results; editing any of them invalidates the cache
+CODE_MODULES = ('actor', 'simulation', 'arraysim', 'tracing', 'waning', 'pcrlab', 'template', 'ensemble')
+
+
+def normalizeParameters(simulationParameters):
+    '''Plain, JSON-serializable dict of every parameter value, class defaults included'''
+    p = simulationParameters
+    names = sorted(name for name in set(dir(p)) - {'variantParameters'}
+                   if not name.startswith('_') and not callable(getattr(p, name)))
+    normalized = {name: _plain(getattr(p, name)) for name in names}
+    normalized['variantParameters'] = {name: _plain(vars(variant))
+                                       for name, variant in sorted(p.variantParameters.items())}
+    return normalized
+
+
+def _plain(value):
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _seed(seed):
+    if isinstance(seed, np.random.SeedSequence):
+        return [seed.entropy, list(seed.spawn_key)]
+    return seed
+
+
+_codeVersion = None
+
+
+def codeVersion():
+    '''Hash of the source of CODE_MODULES'''
+    global _codeVersion
+    if _codeVersion is None:
+        digest = hashlib.sha256()
+        for name in CODE_MODULES:
+            module = sys.modules.get(name) or __import__(name)
+            with open(module.__file__, 'rb') as f:
+                digest.update(f.read())
+        _codeVersion = digest.hexdigest()[:16]
+    return _codeVersion
+
+
+def resultKey(simulationParameters, seed, days, **extra):
+    '''Stable key of one run; extra holds any other setting the result depends on'''
+    content = {'parameters': normalizeParameters(simulationParameters), 'seed': _seed(seed), 'days': days,
+               'code': codeVersion(), 'extra': _plain(extra)}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    '''Directory of results, evicting the least recently used entries beyond maxBytes.
+
+    get() returns a dict with 'totals', 'metadata' and, if stored, 'records'
+    ((from_id, to_id, variant index, time) arrays), or None on a miss.
+    '''
+
+    def __init__(self, directory, maxBytes=1 << 30):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        return self._load(key, touch=True)
+
+    def _load(self, key, touch):
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                entry = {'totals': data['totals'], 'metadata': json.loads(str(data['metadata']))}
+                if 'from_id' in data:
+                    entry['records'] = tuple(data[name] for name in ('from_id', 'to_id', 'variant', 'time'))
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        if touch:
+            # the modification time is the LRU clock
+            os.utime(path)
+        return entry
+
+    def put(self, key, totals, records=None, metadata=None):
+        arrays = {'totals': np.asarray(totals), 'metadata': np.array(json.dumps(_plain(metadata or {})))}
+        if records is not None:
+            arrays.update(zip(('from_id', 'to_id', 'variant', 'time'), records))
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp, self._path(key))
+        self.evict()
+
+    def entries(self):
+        '''(key, entry) of every cached result'''
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith('.npz'):
+                entry = self._load(name[:-len('.npz')], touch=False)
+                if entry is not None:
+                    yield name[:-len('.npz')], entry
+
+    def evict(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.name))
+        total = sum(size for mtime, size, name in files)
+        for mtime, size, name in sorted(files):
+            if total <= self.maxBytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
@@ -0,0 +1,215 @@
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+import numpy as np
+import arraysim
+from arraysim import (CompiledParameters, PopulationState, InfectionLog, TOTALS, stateLayout, shards,
+                      initializePopulation, runStatistics, tickInteractions, tickPcrResults, tickTesting, tickProgress)
+from pcrlab import PcrLab
+
+# Multi-process engine: one population in shared memory, partitioned into contiguous
+# shards, one worker process per shard. Per tick every worker
+#   1. samples the encounters of its infectious actors (reading any shard) and writes
+#      the resulting exposures to its outbox,
+#   2. after a barrier, applies the exposures aimed at its own shard from every outbox,
+#      then runs testing, its PCR lab, vaccination and disease progression on its own shard,
+# followed by a barrier at the end of the tick. Every worker runs its own PCR lab
+# for its shard, with the share of pcrLabCapacity of the shard's size.
+
+# Control commands
+STOP = 0
+TICK = 1
+RECORDS = 2
+
+_ALIGN = 64
+
+
+class SharedArrays:
+    '''Named numpy arrays laid out in a single multiprocessing.shared_memory block.
+
+    Create with a layout [(name, shape, dtype)]; other processes attach with
+    SharedArrays(spec=arrays.spec). Only the creator unlinks the block.
+    '''
+
+    def __init__(self, layout=None, spec=None, readonly=False):
+        if spec is None:
+            offsets, size = self._offsets(layout)
+            self.shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+            self.owner = True
+            self.spec = (self.shm.name, layout)
+        else:
+            name, layout = spec
+            offsets, size = self._offsets(layout)
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+            self.spec = spec
+        self.arrays = {}
+        for (name, shape, dtype), offset in zip(layout, offsets):
+            array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+            array.flags.writeable = not readonly
+            self.arrays[name] = array
+
+    @staticmethod
+    def _offsets(layout):
+        offsets, size = [], 0
+        for name, shape, dtype in layout:
+            offsets.append(size)
+            size += -(-int(np.prod(shape)) * np.dtype(dtype).itemsize // _ALIGN) * _ALIGN
+        return offsets, size
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def close(self):
+        self.arrays = {}
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _worker(index, bounds, stateSpec, mailSpec, parameters, barrier, seed, conn):
+    state = SharedArrays(spec=stateSpec)
+    mail = SharedArrays(spec=mailSpec)
+    population = PopulationState.fromArrays(parameters.populationSize, state.arrays)
+    sl = bounds[index]
+    rng = np.random.default_rng(seed)
+    log = InfectionLog()
+    capacity = parameters.pcrLabCapacity
+    if capacity is not None:
+        capacity = capacity * (sl.stop - sl.start) / parameters.populationSize
+    lab = PcrLab(capacity, parameters.daysToPcrResults)
+    control, count, totals, labs = mail['control'], mail['count'], mail['totals'], mail['labs']
+    targets, infectors, variants = mail['targets'], mail['infectors'], mail['variants']
+    try:
+        while True:
+            barrier.wait()
+            command, days, clock = control
+            if command == STOP:
+                break
+            if command == RECORDS:
+                conn.send(log.arrays())
+                continue
+
+            hit = tickInteractions(population, parameters, sl, days, clock, rng)
+            n = len(hit[0])
+            targets[index, :n], infectors[index, :n], variants[index, :n] = hit
+            count[index] = n
+            barrier.wait()
+
+            # every outbox, in worker order; tickTesting keeps the exposures aimed at this shard
+            inbox = [np.concatenate([column[w, :count[w]] for w in range(len(bounds))]).astype(np.int64)
+                     for column in (targets, infectors, variants)]
+            tickPcrResults(population, parameters, lab, clock + days)
+            rapid, samples = tickTesting(population, parameters, sl, days, clock, rng, log, *inbox)
+            lab.submit(clock, *samples)
+            lab.process(clock, days)
+            tickPcrResults(population, parameters, lab, clock + days)
+            totals[index] = tickProgress(population, parameters, sl, days, clock, rng)
+            labs[index] = (lab.queued, lab.history[-1][2], lab.history[-1][2] * lab.history[-1][3])
+            barrier.wait()
+    except BaseException:
+        barrier.abort()
+        raise
+    finally:
+        del population, control, count, totals, labs, targets, infectors, variants
+        state.close()
+        mail.close()
+        conn.close()
+
+
+class SharedSimulation:
+    '''arraysim.ArraySimulation partitioned across worker processes.
+
+    The population state lives in shared memory; each worker runs the per-actor
+    phases on its own shard, and exposures that cross shards are exchanged through
+    per-worker outboxes with a barrier per tick. Use as a context manager, or call
+    close(), to stop the workers and free the shared memory.
+    '''
+
+    def __init__(self, simulationParameters, workers=None, seed=None):
+        self.simulationParameters = simulationParameters
+        self.parameters = p = CompiledParameters(simulationParameters)
+        if p.contactTracingCoverage:
+            raise ValueError('SharedSimulation does not support contact tracing; use ArraySimulation')
+        self.simClock = 0
+        self.pcrTurnaround = 0.0
+        self.workers = workers or os.cpu_count()
+        self.bounds = shards(p.populationSize, self.workers)
+
+        seeds = np.random.SeedSequence(seed).spawn(self.workers + 1)
+        self.log = InfectionLog()
+        self.state = SharedArrays(stateLayout(p.populationSize, len(p.variants)))
+        population = PopulationState(p.populationSize, len(p.variants), self.state.arrays)
+        self.totals = runStatistics(initializePopulation(population, p, np.random.default_rng(seeds[-1]), self.log))
+
+        # outbox capacity: every actor of the largest shard infecting at most maxInteractions others
+        capacity = max(sl.stop - sl.start for sl in self.bounds) * p.maxInteractions
+        self.mail = SharedArrays([
+            ('control', (3,), np.float64),
+            ('count', (self.workers,), np.int64),
+            ('totals', (self.workers, len(TOTALS)), np.float64),
+            # PCR lab queue length, samples processed and their total turnaround
+            ('labs', (self.workers, 3), np.float64),
+            ('targets', (self.workers, capacity), np.int32),
+            ('infectors', (self.workers, capacity), np.int32),
+            ('variants', (self.workers, capacity), np.int8),
+        ])
+
+        context = multiprocessing.get_context()
+        self.barrier = context.Barrier(self.workers + 1)
+        self.connections = []
+        self.processes = []
+        for index in range(self.workers):
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker, daemon=True,
+                                      args=(index, self.bounds, self.state.spec, self.mail.spec, p,
+                                            self.barrier, seeds[index], child))
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    def _command(self, command, days=0):
+        self.mail['control'][:] = (command, days, self.simClock)
+        self.barrier.wait()
+
+    def tick(self, days=1):
+        self.simClock += days
+        self._command(TICK, days)
+        self.barrier.wait()     # encounters sampled, outboxes written
+        self.barrier.wait()     # exposures applied, shards ticked
+        totals = self.mail['totals'].sum(axis=0)
+        queued, processed, turnaround = self.mail['labs'].sum(axis=0)
+        if processed:
+            self.pcrTurnaround = turnaround / processed
+        totals[TOTALS.index('pcrQueue')] = queued
+        totals[TOTALS.index('pcrTurnaround')] = self.pcrTurnaround
+        self.totals = runStatistics(totals)
+
+    def infectionRecords(self):
+        '''(from_id, to_id, variant index, time) arrays of every infection so far'''
+        self._command(RECORDS)
+        parts = [self.log.arrays()] + [connection.recv() for connection in self.connections]
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    def infectionsDF(self):
+        return arraysim.infectionsDF(self.infectionRecords(), self.parameters.variants)
+
+    def close(self):
+        if not self.processes:
+            return
+        if not self.barrier.broken:
+            self._command(STOP)
+        for process in self.processes:
+            process.join()
+        for connection in self.connections:
+            connection.close()
+        self.processes = []
+        self.state.close()
+        self.mail.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
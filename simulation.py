@@ -3,7 +3,8 @@ import math
 import random
 from actor import Actor, ACTOR_STATUS, InfectionRecord
 from util import gaussianRandom
-import pandas as pd
+from waning import waningTable
+from pcrlab import PcrLab
 
 
 #Demographics
@@ -55,6 +56,10 @@ class SimulationParameters :
     # Vaccination delay
     vaccinationDelay = 28
 
+    # Waning of vaccine protection after the delay: None, or a waning curve (see waning.py),
+    # e.g. ('exponential', 0.999)
+    vaccinationWaning = None
+
     # Non compliance rate
     # TODO: This parameter is sampled and assigned to actors, but never actively used
     nonCompliantRate = 0.0
@@ -65,7 +70,22 @@ class SimulationParameters :
 
     ###  Interation Parameters  ##########################################################
 
-    # TODO: Contact tracing parameters go here
+    ###  Contact Tracing Parameters  ##########################################################
+
+    # % of the contacts of a positive case that are traced (Float, 0-1). 0 turns tracing off
+    contactTracingCoverage = 0.0
+
+    # Days from the positive result until a traced contact is reached
+    contactTracingDelay = 1.0
+
+    # Days of encounters traced back
+    contactTracingDays = 7
+
+    # What a traced contact does: 'isolate' (quarantine) or 'test' (rapid test, isolate if positive)
+    contactTracingAction = 'isolate'
+
+    # Quarantine of traced contacts (days)
+    contactTracingQuarantine = 10
 
     ###  Infection Parameters  ##########################################################
     
@@ -111,9 +131,14 @@ class SimulationParameters :
     # False negative % for PCR (Float, 01)
     falseNegativePcr = 0.02
 
-    # The delay from PCR test to results. Isolation is delayed by this ammount
+    # The delay from PCR test to results. Isolation is delayed by this ammount; results due
+    # within the tick of the test (delays under a day) are delivered at the end of that tick
     daysToPcrResults = 1.5
 
+    # PCR samples the lab processes per day (Int), None for unlimited. Samples wait in a first in,
+    # first out queue; results come back daysToPcrResults after processing
+    pcrLabCapacity = None
+
 
     # Days to detectable (Float)
     # NOT CURRENTLY USED
@@ -127,7 +152,8 @@ class SimulationParameters :
     populationByAge=[0.047,0.163,0.162,0.136,0.123,0.129,0.101,0.053,0.023]
 
     def __init__(self):
-        # Create a dictionary of variant parameters
+        # Create a dictionary of variant parameters, per instance so copies can differ
+        self.variantParameters = {}
         for v in self.startingVariantMix:
             self.variantParameters[v] = VariantParameters(v)
             
@@ -192,6 +218,10 @@ class VariantParameters :
         # Recovered Resistance (%, as a probability?)
         self.recoveredResistance = {'alpha': 0.95, 'beta': 0.95, 'delta': 0.9, 'omicron': 0.8}
 
+        # Waning of the recoveredResistance an infection with this variant gives: None, or a
+        # waning curve (see waning.py)
+        self.recoveredWaning = None
+
         # approx from Dec 2020. Crude interpolation
         #  https://www.ncbi.nlm.nih.gov/pmc/articles/PMC7721859/pdf/10654_2020_Article_698.pdf
         self.infectionFatalityRateByAge=[0.00004,0.00004,0.00004,0.00068,0.023,0.0775,0.025,0.085,0.283]
@@ -216,6 +246,10 @@ class RunStatistics:
     deceased = 0
     testsConducted = 0
     daysLost = 0
+    # PCR samples waiting in the lab, and the mean days from sample to result of the
+    # samples processed last
+    pcrQueue = 0
+    pcrTurnaround = 0.0
 
 
 class Simulation:
@@ -225,6 +259,20 @@ class Simulation:
         self.totals = RunStatistics()
         self.simClock = 0
 
+        # PCR lab queue
+        self.pcrLab = PcrLab(self.simulationParameters.pcrLabCapacity, self.simulationParameters.daysToPcrResults)
+
+        # Waning tables, indexed by whole days (see waning.py)
+        self.vaccinationWaning = waningTable(self.simulationParameters.vaccinationWaning)
+        self.recoveredWaning = {name: waningTable(v.recoveredWaning)
+                                for name, v in self.simulationParameters.variantParameters.items()}
+
+        # Encounter buffers for contact tracing, only when tracing is on
+        self.tracer = None
+        if self.simulationParameters.contactTracingCoverage:
+            from tracing import ContactTracer
+            self.tracer = ContactTracer.fromParameters(self.simulationParameters)
+
         rows = math.floor(math.sqrt(self.simulationParameters.populationSize))
         for i in range(self.simulationParameters.populationSize):
             a = Actor(self)
@@ -323,6 +371,8 @@ class Simulation:
             newTotals.testsConducted += actor.testsConducted
             newTotals.daysLost += actor.daysIsolated
 
+        newTotals.pcrQueue = self.pcrLab.queued
+        newTotals.pcrTurnaround = self.pcrLab.turnaround
         self.totals = newTotals
 
     # Check for exposure in either direction and infect the susceptible actor
@@ -346,6 +396,7 @@ class Simulation:
     #  This is not used if interactions are based on collision detection.
 
     def tickInteractions(self, days=1.0):
+        encounters = []
         for actor in self.actors:
             if (actor.status == ACTOR_STATUS.INFECTIOUS and not actor.isolated):
                 # Determine if we infect based on # of interactions and % of day passed
@@ -357,6 +408,12 @@ class Simulation:
                     encounter_list = random.sample(range(len(self.actors)), int(interactions))
                     for idx in encounter_list:
                         self.checkExposure(self.actors[idx], actor)
+                    if self.tracer is not None:
+                        encounters.extend((actor.id, idx) for idx in encounter_list)
+
+        if encounters:
+            a, b = zip(*encounters)
+            self.tracer.record(a, b, self.simClock)
 
     #   This is the outer tick. To be overriden by subclasses.
     #   Should implement policies such as social distancing,
@@ -367,21 +424,27 @@ class Simulation:
         self.simClock += days
 
         self.tickInteractions(days)
+        self.tickPcrResults(days)
         self.tickRapidTesting(days)
         self.tickPcrTesting(days)
+        # results of this tick's samples that are due within the tick (daysToPcrResults < days)
+        self.tickPcrResults(days)
         self.tickVaccination(days)
         self.tickDisease(days)
+        self.tickContactTracing(days)
 
     # Implement daily rapid testing policy
 
     def tickRapidTesting(self, days=1.0):
         # Perform rapid testing
+        positives = []
         for actor in self.actors:
             if (((actor.isTesting and (actor.testTime is None
                                        or actor.testTime >= self.simulationParameters.testingInterval))
                  or (random.random() < self.simulationParameters.testingRateRandom / days))
                     and not actor.isolated
                     and actor.rapidTest()):
+                positives.append(actor.id)
                 # TODO: Can sample these as well.
                 if (random.random() < self.simulationParameters.positiveQuarantineRate):
                     actor.isolateFor(self.simulationParameters.positiveTestIsolationInterval)
@@ -394,29 +457,72 @@ class Simulation:
             if (actor.isSymptomatic and actor.willSelfIsolate and not actor.isolated):
                 actor.isolateFor(self.simulationParameters.positiveTestIsolationInterval)
 
+        self.traceContacts(positives)
+
     # Implement pcr testing policy
 
     def tickPcrTesting(self, days=1.0):
-        # Perform pcr testing
+        # Perform pcr testing; samples go to the lab, see tickPcrResults
+        samples = []
         for actor in self.actors:
             if (
                     ((random.random() < self.simulationParameters.testingRateRandomPcr / days) or
                      (actor.isTestingPcr and (actor.testTimePcr is None or
                                               actor.testTimePcr >= self.simulationParameters.testingIntervalPcr)))
-                    and not actor.isolated and actor.pcrTest()):
+                    and not actor.isolated):
+                positive = actor.pcrTest()
                 # TODO: Can sample these as well.
-                if (random.random() < self.simulationParameters.positiveQuarantineRate):
-                    # print('Isolated PCR', actor.id)
-                    actor.isolateFor(self.simulationParameters.positiveTestIsolationInterval,
-                                     self.simulationParameters.daysToPcrResults)
-                else:
-                    pass
-                    # print(('Isolation non compliance', actor.id)
+                isolate = positive and random.random() < self.simulationParameters.positiveQuarantineRate
+                samples.append((actor.id, positive, isolate))
 
             # TODO: Some actors become sick and never become "unsick" so they isolate forever.
             if (actor.isSymptomatic and actor.willSelfIsolate and not actor.isolated):
                 actor.isolateFor(self.simulationParameters.positiveTestIsolationInterval)
 
+        if samples:
+            self.pcrLab.submit(self.simClock, *zip(*samples))
+        self.pcrLab.process(self.simClock, days)
+
+    # Deliver the PCR results due during this tick: positives isolate (if compliant)
+    # and are traced
+
+    def tickPcrResults(self, days=1.0):
+        positives = []
+        for ids, positive, isolate in self.pcrLab.due(self.simClock + days):
+            for idx, isPositive, willIsolate in zip(ids, positive, isolate):
+                if willIsolate:
+                    # print('Isolated PCR', idx)
+                    self.actors[idx].isolateFor(self.simulationParameters.positiveTestIsolationInterval)
+                if isPositive:
+                    positives.append(idx)
+        self.traceContacts(positives)
+
+    # Contact tracing: the contacts of positive cases are reached after a delay,
+    # and isolate or get tested
+
+    def traceContacts(self, positives):
+        if self.tracer is None or not positives:
+            return
+        traced = [idx for idx in self.tracer.contactsOf(positives, self.simClock)
+                  if random.random() < self.simulationParameters.contactTracingCoverage]
+        self.tracer.schedule(traced, self.simClock + self.simulationParameters.contactTracingDelay)
+
+    def tickContactTracing(self, days=1.0):
+        if self.tracer is None:
+            return
+        positives = []
+        for idx in self.tracer.due(self.simClock):
+            actor = self.actors[idx]
+            if actor.isolated or actor.status == ACTOR_STATUS.DECEASED:
+                continue
+            if self.simulationParameters.contactTracingAction == 'isolate':
+                actor.isolateFor(self.simulationParameters.contactTracingQuarantine)
+            elif actor.rapidTest():
+                positives.append(actor.id)
+                if (random.random() < self.simulationParameters.positiveQuarantineRate):
+                    actor.isolateFor(self.simulationParameters.positiveTestIsolationInterval)
+        self.traceContacts(positives)
+
     def tickVaccination(self, days=1.0):
         # Perform random vaccination
         # TODO: find a better way to do
@@ -427,6 +533,8 @@ class Simulation:
                 
     def infectionsDF(self):
         '''Return a pandas dataframe with the infection spread data'''
+        import pandas as pd
+
         vars = []
         for a in self.actors:
             for i in a.infections:
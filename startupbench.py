@@ -0,0 +1,64 @@
+'''Cold-start import benchmark.
+
+Imports each module in a fresh interpreter with `python -X importtime` and fails
+(exit status 1) if the best cumulative import time over --runs runs exceeds the
+module's budget, or if importing it pulls in a dependency that should only be
+loaded when the feature using it is called.
+
+    python startupbench.py [--runs 5] [--scale 1.0]
+'''
+import argparse
+import subprocess
+import sys
+
+# Budget in milliseconds of cumulative import time (best of runs).
+# numpy alone is most of the locsim budget.
+BUDGETS = {
+    'util': 20,
+    'infection': 25,
+    'actor': 40,
+    'simulation': 60,
+    'locsim': 250,
+}
+
+# Heavy dependencies that must only be imported lazily
+LAZY = ['pandas', 'scipy']
+
+
+def importTimes(module):
+    '''Return {module name: cumulative import time in us} for a cold import of module'''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply all budgets, for slow machines')
+    args = parser.parse_args()
+
+    failed = False
+    for module, budget in BUDGETS.items():
+        runs = [importTimes(module) for i in range(args.runs)]
+        best = min(times[module] for times in runs) / 1000
+        lazy = sorted(name for name in runs[0] if name.split('.')[0] in LAZY)
+        status = 'ok'
+        if best > budget * args.scale:
+            status = 'SLOW'
+        if lazy:
+            status = 'EAGER ' + ','.join(lazy[:3])
+        failed |= status != 'ok'
+        print(f'{module:12} {best:8.1f} ms  budget {budget * args.scale:6.0f} ms  {status}')
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import numpy as np
+import locsim
+from arraysim import (CompiledParameters, PopulationState, InfectionLog, PairedRandom, STATE_FIELDS,
+                      initializePopulation)
+from sharedsim import SharedArrays
+
+# Population templates: the starting population is built once, published read-only
+# (shared memory), and every replicate attaches to it and copies only the state it
+# mutates during a run.
+# locsim populations and contact graphs are read-only during a run, so a LocsimTemplate
+# shares them whole and every replicate only allocates its masks and event log.
+
+# Population state that never changes after initialization; replicates use it in place
+IMMUTABLE_FIELDS = ('isTesting', 'isTestingPcr', 'isNonCompliant', 'ageBracket')
+
+# Columns of the starting infection records (initial infected and recovered)
+RECORD_FIELDS = (('recordFrom', np.int64), ('recordTo', np.int64), ('recordVariant', np.int8), ('recordTime', np.float64))
+
+
+def publishArrays(arrays):
+    '''Copy named arrays into a new shared memory block. Returns the (owning) SharedArrays.'''
+    shared = SharedArrays([(name, array.shape, array.dtype) for name, array in arrays.items()])
+    for name, array in arrays.items():
+        shared[name][...] = array
+    return shared
+
+
+def attachArrays(spec):
+    '''Attach read-only to arrays published with publishArrays. Returns the SharedArrays.'''
+    return SharedArrays(spec=spec, readonly=True)
+
+
+class PopulationTemplate:
+    '''Starting population of an ArraySimulation, built once for many replicates.
+
+    Ages, testing enrolment and the initial infected/recovered/vaccinated sets are
+    drawn from seed. publish() moves the arrays into shared memory and returns a
+    picklable handle that other processes pass to PopulationTemplate.attach().
+    With paired=True the population is drawn as for paired ArraySimulation runs.
+    '''
+
+    def __init__(self, simulationParameters, seed=None, paired=False):
+        if isinstance(simulationParameters, CompiledParameters):
+            self.parameters = simulationParameters
+        else:
+            self.parameters = CompiledParameters(simulationParameters)
+        p = self.parameters
+        state = PopulationState(p.populationSize, len(p.variants))
+        log = InfectionLog()
+        rng = PairedRandom(seed) if paired else np.random.default_rng(seed)
+        self.totals = initializePopulation(state, p, rng, log)
+        self.arrays = state.arrays()
+        self.arrays.update(zip((name for name, dtype in RECORD_FIELDS), log.arrays()))
+        self.shared = None
+
+    def publish(self):
+        if self.shared is None:
+            self.shared = publishArrays(self.arrays)
+            self.arrays = self.shared.arrays
+            for array in self.arrays.values():
+                array.flags.writeable = False
+        return (self.shared.spec, self.parameters, self.totals)
+
+    @classmethod
+    def attach(cls, handle):
+        spec, parameters, totals = handle
+        template = cls.__new__(cls)
+        template.parameters = parameters
+        template.totals = totals
+        template.shared = attachArrays(spec)
+        template.arrays = template.shared.arrays
+        return template
+
+    def instantiate(self):
+        '''(PopulationState, starting totals row, InfectionLog) for one replicate'''
+        arrays = {name: self.arrays[name] if name in IMMUTABLE_FIELDS else self.arrays[name].copy()
+                  for name, dtype, fill, perVariant in STATE_FIELDS}
+        log = InfectionLog()
+        log.parts.append(tuple(self.arrays[name] for name, dtype in RECORD_FIELDS))
+        return PopulationState.fromArrays(self.parameters.populationSize, arrays), self.totals.copy(), log
+
+    def close(self):
+        if self.shared is not None:
+            self.arrays = {}
+            self.shared.close()
+            self.shared = None
+
+
+class LocsimTemplate:
+    '''Population and contact graph of a locsim Simulation, built once for many replicates.
+
+    The population is drawn from seed (see locsim.buildPopulation). publish() moves
+    both into shared memory and returns a picklable handle that other processes pass
+    to LocsimTemplate.attach().
+    '''
+
+    def __init__(self, parameters, seed=None, cacheDir=None):
+        self.parameters = parameters
+        self.population = locsim.buildPopulation(parameters, seed, cacheDir)
+        self.graph = locsim.ContactGraph.fromPopulation(self.population)
+        self.shared = None
+
+    def _bind(self, arrays):
+        self.population = locsim.Population(**{name: arrays['population.' + name]
+                                               for name in locsim.Population.fields})
+        self.graph = locsim.ContactGraph.fromArrays({name: arrays['graph.' + name]
+                                                     for name in locsim.ContactGraph.fields})
+
+    def publish(self):
+        if self.shared is None:
+            arrays = {'population.' + name: getattr(self.population, name) for name in locsim.Population.fields}
+            arrays.update(('graph.' + name, array) for name, array in self.graph.arrays().items())
+            self.shared = publishArrays(arrays)
+            for array in self.shared.arrays.values():
+                array.flags.writeable = False
+            self._bind(self.shared.arrays)
+        return (self.shared.spec, self.parameters)
+
+    @classmethod
+    def attach(cls, handle):
+        spec, parameters = handle
+        template = cls.__new__(cls)
+        template.parameters = parameters
+        template.shared = attachArrays(spec)
+        template._bind(template.shared.arrays)
+        return template
+
+    def instantiate(self, rng=None):
+        '''locsim.Simulation of one replicate drawing from rng, reading the shared population and graph'''
+        return locsim.Simulation(self.parameters, population=self.population, graph=self.graph, rng=rng)
+
+    def close(self):
+        if self.shared is not None:
+            self.population = self.graph = None
+            self.shared.close()
+            self.shared = None
@@ -0,0 +1,84 @@
+import heapq
+import math
+import numpy as np
+
+# Contact tracing. Every actor keeps its most recent encounters in a fixed size ring
+# buffer (one row of preallocated arrays), so memory is bounded by the population
+# size and tracing a positive case reads only that case's row.
+
+# What a traced contact does (SimulationParameters.contactTracingAction)
+ACTIONS = ('isolate', 'test')
+
+
+class ContactTracer:
+    '''Encounter ring buffers and the queue of traced contacts waiting to be reached.
+
+    days is how far back contacts are traced; each actor keeps the last
+    capacity encounters, by default enough for days of perDay encounters (older
+    ones are overwritten).
+    '''
+
+    def __init__(self, populationSize, days, perDay=1.0, capacity=None):
+        self.days = days
+        self.capacity = capacity or max(1, int(math.ceil(days * perDay)))
+        self.contacts = np.full((populationSize, self.capacity), -1, dtype=np.int32)
+        self.times = np.zeros((populationSize, self.capacity), dtype=np.float32)
+        self.head = np.zeros(populationSize, dtype=np.int32)
+        self.pending = []
+        self.scheduled = 0
+        self.reached = 0
+
+    @classmethod
+    def fromParameters(cls, simulationParameters):
+        '''Tracer sized for simulationParameters, or None if contact tracing is off'''
+        p = simulationParameters
+        if not p.contactTracingCoverage:
+            return None
+        if p.contactTracingAction not in ACTIONS:
+            raise ValueError(f'contactTracingAction must be one of {ACTIONS}, not {p.contactTracingAction!r}')
+        # an infectious actor meets numInteractions others a day; anyone may be met by them
+        return cls(p.populationSize, p.contactTracingDays, 2 * (p.numInteractions + 2 * p.numInteractionsSTD))
+
+    def record(self, a, b, clock):
+        '''Record encounters a[i] <-> b[i] at clock in both actors' buffers'''
+        a = np.asarray(a, dtype=np.int64)
+        b = np.asarray(b, dtype=np.int64)
+        distinct = a != b
+        owner = np.concatenate([a[distinct], b[distinct]])
+        other = np.concatenate([b[distinct], a[distinct]])
+        if len(owner) == 0:
+            return
+        order = np.argsort(owner, kind='stable')
+        owner, other = owner[order], other[order]
+        starts = np.flatnonzero(np.concatenate(([True], owner[1:] != owner[:-1])))
+        counts = np.diff(np.append(starts, len(owner)))
+        rank = np.arange(len(owner)) - np.repeat(starts, counts)
+        slot = (self.head[owner] + rank) % self.capacity
+        self.contacts[owner, slot] = other
+        self.times[owner, slot] = clock
+        first = owner[starts]
+        self.head[first] = (self.head[first] + counts) % self.capacity
+
+    def contactsOf(self, ids, clock):
+        '''Distinct actors met by any of ids in the last days before clock'''
+        ids = np.asarray(ids, dtype=np.int64)
+        contacts = self.contacts[ids]
+        recent = (contacts >= 0) & (self.times[ids] >= clock - self.days)
+        return np.unique(contacts[recent]).astype(np.int64)
+
+    def schedule(self, ids, due):
+        '''Reach contacts ids at clock due'''
+        if len(ids):
+            heapq.heappush(self.pending, (due, self.scheduled, np.asarray(ids, dtype=np.int64)))
+            self.scheduled += 1
+
+    def due(self, clock):
+        '''Contacts to be reached by clock, each once'''
+        parts = []
+        while self.pending and self.pending[0][0] <= clock + 1e-9:
+            parts.append(heapq.heappop(self.pending)[2])
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        ids = np.unique(np.concatenate(parts))
+        self.reached += len(ids)
+        return ids
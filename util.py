@@ -1,6 +1,6 @@
 
-from scipy.stats import norm
+import random
 
 def gaussianRandom(mu,var=1.0):
-    return norm.rvs(mu,var)
+    return random.gauss(mu,var)
 
@@ -0,0 +1,36 @@
+import math
+
+# Waning protection. A waning curve is None (no waning) or a tuple (name, *arguments)
+# naming one of CURVES, e.g. ('exponential', 0.999) or ('linear', 365). It gives the
+# fraction of full protection left a whole number of days after the protection was
+# acquired. Curves are tabulated once per run (waningTable) and read by day index
+# (waningIndex), so the exposure checks do no arithmetic on them.
+
+# Length of the tables; protection later than this stays at the last value
+WANING_DAYS = 3650
+
+CURVES = {
+    # rate ** days
+    'exponential': lambda days, rate: rate ** days,
+    # halved every halfLife days
+    'halfLife': lambda days, halfLife: 0.5 ** (days / halfLife),
+    # straight down to floor over duration days
+    'linear': lambda days, duration, floor=0.0: max(floor, 1.0 - (1.0 - floor) * days / duration),
+    # 1 / (1 + exp((days - midpoint) / width))
+    'logistic': lambda days, midpoint, width: 1.0 / (1.0 + math.exp(min((days - midpoint) / width, 700.0))),
+    # explicit daily values, the last one repeated
+    'table': lambda days, *values: values[min(days, len(values) - 1)],
+}
+
+
+def waningTable(curve, days=WANING_DAYS):
+    '''List of the fraction of protection left 0..days days after it was acquired'''
+    if curve is None:
+        return [1.0] * (days + 1)
+    name, *arguments = curve
+    return [float(CURVES[name](day, *arguments)) for day in range(days + 1)]
+
+
+def waningIndex(days):
+    '''Index into a waning table of days since the protection was acquired'''
+    return min(max(int(days), 0), WANING_DAYS)